@@ -0,0 +1,165 @@
+"""Exact-match cache for first-turn AI answers.
+
+Students often open a chat with the very same question. For the first turn of a
+chat there is no history, so the answer depends only on the prompt and the AI
+route, and a previous answer can be served again without an LLM round trip.
+
+Two storages are available: ``memory`` keeps entries in-process, ``mongo``
+shares them across workers through the ``answer_cache`` collection. Both expire
+entries after a TTL and are bounded in size.
+"""
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from arabic_text import normalize_arabic
+
+# How many Mongo writes happen between two size checks
+MONGO_TRIM_INTERVAL = 100
+
+# Sentence punctuation ending a word, and quotes; "3.5" or "2-1" keep their meaning
+PROMPT_PUNCTUATION = re.compile(r"[.,!?;:،؛؟…]+(?=\s|$)|[\"'«»“”]")
+
+
+def normalize_prompt(text: str) -> str:
+    """Normalize a prompt so trivially different spellings and punctuation share an entry"""
+    return " ".join(PROMPT_PUNCTUATION.sub(" ", normalize_arabic(text)).split())
+
+
+def cache_key(chat_type: str, prompt: str) -> str:
+    return hashlib.sha256(f"{chat_type}\n{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+class AnswerCache:
+    """Common counters for answer cache storages"""
+
+    kind = None
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, chat_type: str, prompt: str) -> Optional[str]:
+        answer = await self._get(cache_key(chat_type, prompt))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    async def set(self, chat_type: str, prompt: str, answer: str):
+        await self._set(cache_key(chat_type, prompt), chat_type, answer)
+        self.stores += 1
+
+    async def ensure_indexes(self):
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "kind": self.kind,
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MemoryAnswerCache(AnswerCache):
+    kind = "memory"
+
+    def __init__(self, ttl: float, max_entries: int, clock=time.monotonic):
+        super().__init__(ttl, max_entries)
+        self.clock = clock
+        # key -> (answer, expires at), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        answer, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return answer
+
+    async def _set(self, key: str, chat_type: str, answer: str):
+        self._entries[key] = (answer, self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), "size": len(self._entries)}
+
+
+class MongoAnswerCache(AnswerCache):
+    kind = "mongo"
+
+    def __init__(self, db, ttl: float, max_entries: int):
+        super().__init__(ttl, max_entries)
+        self.db = db
+        self._writes_since_trim = 0
+
+    @property
+    def collection(self):
+        # Resolved on use, so the Mongo client is not created at import
+        return self.db.answer_cache
+
+    async def ensure_indexes(self):
+        # Mongo removes expired entries in the background
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index("created_at")
+
+    async def _get(self, key: str) -> Optional[str]:
+        entry = await self.collection.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+            {"answer": 1},
+        )
+        return entry['answer'] if entry else None
+
+    async def _set(self, key: str, chat_type: str, answer: str):
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {
+                "chat_type": chat_type,
+                "answer": answer,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl),
+            }},
+            upsert=True,
+        )
+        self._writes_since_trim += 1
+        if self._writes_since_trim >= MONGO_TRIM_INTERVAL:
+            self._writes_since_trim = 0
+            await self.trim()
+
+    async def trim(self):
+        """Delete the oldest entries beyond ``max_entries``"""
+        excess = await self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return
+        oldest = await self.collection.find({}, {"_id": 1}).sort("created_at", 1).limit(excess).to_list(excess)
+        await self.collection.delete_many({"_id": {"$in": [entry['_id'] for entry in oldest]}})
+
+
+def create_answer_cache(kind: str, db, ttl: float, max_entries: int) -> Optional[AnswerCache]:
+    """Create the answer cache configured by ``kind`` ('', 'memory' or 'mongo')"""
+    if not kind:
+        return None
+    if kind == "memory":
+        return MemoryAnswerCache(ttl, max_entries)
+    if kind == "mongo":
+        return MongoAnswerCache(db, ttl, max_entries)
+    raise ValueError(f"Unknown answer cache: {kind}")
@@ -0,0 +1,55 @@
+"""Arabic text normalization shared by routing, caching and search.
+
+Students type the same word in many ways: with or without diacritics, with
+tatweel, with different alef forms, or with taa marbuta written as haa.
+``normalize_arabic`` maps all of these to one canonical spelling.
+
+For search, words are also stripped of the definite article, which Arabic
+writes attached to the word.
+"""
+import re
+from typing import List
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+
+TATWEEL = "\u0640"
+
+CHAR_MAP = str.maketrans({
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    TATWEEL: None,
+})
+
+
+def normalize_arabic(text: str) -> str:
+    """Lowercase, strip diacritics and tatweel and unify alef, yaa and taa marbuta"""
+    return DIACRITICS.sub("", text.casefold()).translate(CHAR_MAP)
+
+
+WORD = re.compile(r"\w+")
+
+# Definite article, alone or after a one-letter conjunction or preposition
+ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+def search_stem(word: str) -> str:
+    """Strip the definite article so that e.g. الرياضيات matches رياضيات"""
+    for prefix in ARTICLE_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            return word[len(prefix):]
+    return word
+
+
+def search_tokens(text: str) -> List[str]:
+    """Normalized and stemmed words of a text, as indexed and searched"""
+    return [search_stem(word) for word in WORD.findall(normalize_arabic(text))]
+
+
+def search_text(text: str) -> str:
+    """Value stored in the text-indexed search fields"""
+    return " ".join(search_tokens(text))
@@ -0,0 +1,239 @@
+"""Compressed archive of the message history of idle chats.
+
+Chats nobody wrote to for a while are compacted: their messages are encoded as
+one BSON document, compressed (gzip, or zstd when the ``zstandard`` package is
+installed) and stored in the ``chat_archives`` collection, then removed from
+the hot ``messages`` collection. The chat document stays where it is as the
+stub the chat list needs (title, ``message_count``, ``last_message``), plus an
+``archived_upto`` marker.
+
+Messages are immutable and the archive is written before the hot copies are
+deleted, so at any moment every message is in the archive, the ``messages``
+collection, or both; ``message_store`` merges the two when loading, which
+makes compaction invisible to clients. New messages on an archived chat are
+appended to ``messages`` as usual and folded into the archive the next time the
+chat goes idle.
+"""
+import asyncio
+import gzip
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import bson
+from pymongo.errors import DuplicateKeyError
+
+from arabic_text import search_tokens
+
+try:
+    import zstandard
+except ImportError:  # optional codec
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Message fields kept in the archive
+ARCHIVE_FIELDS = ("id", "role", "content", "timestamp", "seq")
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def default_codec(requested: str = "gzip") -> str:
+    if requested == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, archiving chats with gzip")
+        return "gzip"
+    return requested
+
+
+def decode_archive(archive: dict) -> List[dict]:
+    """Messages of an archive document, in order"""
+    raw = decompress(archive['data'], archive['codec'])
+    return bson.decode(raw)['messages']
+
+
+async def load_archived(db, chat_id: str) -> List[dict]:
+    """Archived messages of a chat, in order (empty when it has no archive)"""
+    archive = await db.chat_archives.find_one({"_id": chat_id})
+    return decode_archive(archive) if archive else []
+
+
+async def load_archived_for_chats(db, chat_ids: List[str]) -> Dict[str, List[dict]]:
+    archives = await db.chat_archives.find({"_id": {"$in": chat_ids}}).to_list(None)
+    return {archive['_id']: decode_archive(archive) for archive in archives}
+
+
+def contiguous_prefix(messages: List[dict]) -> List[dict]:
+    """Leading messages with consecutive ``seq`` numbers.
+
+    A message whose insert is still in flight leaves a gap; everything after it
+    is left in the hot collection until the next compaction.
+    """
+    for i in range(1, len(messages)):
+        if messages[i]['seq'] != messages[i - 1]['seq'] + 1:
+            return messages[:i]
+    return messages
+
+
+class ChatArchiver:
+    def __init__(self, db, idle_days: float, codec: str = "gzip", batch_size: int = 100):
+        self.db = db
+        self.idle = timedelta(days=idle_days)
+        self.codec = default_codec(codec)
+        self.batch_size = batch_size
+        self.compacted = 0
+        self.archived_messages = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    async def compact_chat(self, chat: dict) -> bool:
+        """Move the hot messages of an idle chat into its archive"""
+        chat_id = chat['id']
+        existing = await self.db.chat_archives.find_one({"_id": chat_id})
+        archived = decode_archive(existing) if existing else []
+        hot = await self.db.messages.find(
+            {"chat_id": chat_id},
+            {field: 1 for field in ARCHIVE_FIELDS},
+        ).sort("seq", 1).to_list(None)
+
+        by_seq = {message['seq']: message for message in archived}
+        for message in hot:
+            by_seq.setdefault(message['seq'], {field: message.get(field) for field in ARCHIVE_FIELDS})
+        messages = contiguous_prefix([by_seq[seq] for seq in sorted(by_seq)])
+        if not messages or len(messages) <= len(archived):
+            return False
+        upto_seq = messages[-1]['seq'] + 1
+
+        raw = bson.encode({"messages": messages})
+        data = compress(raw, self.codec)
+        terms = sorted({term for message in messages for term in search_tokens(message['content'])})
+        archive = {
+            "_id": chat_id,
+            "chat_id": chat_id,
+            "codec": self.codec,
+            "data": data,
+            "upto_seq": upto_seq,
+            "message_count": len(messages),
+            "raw_bytes": len(raw),
+            "archived_at": datetime.utcnow(),
+            "search_text": " ".join(terms),
+        }
+
+        # Never replace an archive with an older view of the chat
+        if existing:
+            result = await self.db.chat_archives.replace_one(
+                {"_id": chat_id, "upto_seq": existing['upto_seq']}, archive,
+            )
+            if not result.matched_count:
+                return False
+        else:
+            try:
+                await self.db.chat_archives.insert_one(archive)
+            except DuplicateKeyError:
+                return False
+
+        await self.db.chats.update_one(
+            {"id": chat_id},
+            {
+                "$max": {"archived_upto": upto_seq},
+                "$set": {"archived_at": archive['archived_at']},
+                "$inc": {"version": 1},
+            },
+        )
+        await self.db.messages.delete_many({"chat_id": chat_id, "seq": {"$lt": upto_seq}})
+
+        self.compacted += 1
+        self.archived_messages += len(messages) - len(archived)
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(data)
+        return True
+
+    async def compact_idle_chats(self) -> int:
+        """Compact chats idle for longer than the configured period, returning how many"""
+        cutoff = datetime.utcnow() - self.idle
+        cursor = self.db.chats.find(
+            {
+                "updated_at": {"$lt": cutoff},
+                "message_count": {"$gt": 0},
+                # Skip chats whose whole history is archived already
+                "$expr": {"$gt": ["$message_count", {"$ifNull": ["$archived_upto", 0]}]},
+            },
+            {"_id": 0, "id": 1},
+        ).batch_size(self.batch_size)
+        compacted = 0
+        async for chat in cursor:
+            try:
+                compacted += await self.compact_chat(chat)
+            except Exception as e:
+                logger.error(f"Error archiving chat {chat['id']}: {str(e)}")
+        if compacted:
+            logger.info(f"Archived the history of {compacted} idle chats")
+        return compacted
+
+    async def run(self, interval: float):
+        """Compact idle chats every ``interval`` seconds"""
+        while True:
+            try:
+                await self.compact_idle_chats()
+            except Exception as e:
+                logger.error(f"Chat archiving failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "idle_days": self.idle.total_seconds() / 86400,
+            "codec": self.codec,
+            "compacted": self.compacted,
+            "archived_messages": self.archived_messages,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "compression_ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else None,
+        }
+
+
+def merge_archived(archived: List[dict], hot: List[dict], limit: Optional[int], before: Optional[int]) -> List[dict]:
+    """Complete a page of hot messages with older archived ones"""
+    first_hot = hot[0]['seq'] if hot else None
+    older = [
+        message for message in archived
+        if (before is None or message['seq'] < before) and (first_hot is None or message['seq'] < first_hot)
+    ]
+    if limit is not None:
+        older = older[max(0, len(older) - (limit - len(hot))):]
+    return older + hot
+
+
+async def trim_archive(db, chat_id: str, before_seq: int) -> int:
+    """Drop archived messages older than ``before_seq``, returning how many"""
+    archive = await db.chat_archives.find_one({"_id": chat_id})
+    if archive is None:
+        return 0
+    messages = decode_archive(archive)
+    kept = [message for message in messages if message['seq'] >= before_seq]
+    if len(kept) == len(messages):
+        return 0
+
+    # Conditional on upto_seq, like compaction, so a concurrent compaction wins
+    current = {"_id": chat_id, "upto_seq": archive['upto_seq']}
+    if not kept:
+        result = await db.chat_archives.delete_one(current)
+        return len(messages) if result.deleted_count else 0
+    raw = bson.encode({"messages": kept})
+    terms = sorted({term for message in kept for term in search_tokens(message['content'])})
+    result = await db.chat_archives.replace_one(current, {
+        **archive,
+        "data": compress(raw, archive['codec']),
+        "message_count": len(kept),
+        "raw_bytes": len(raw),
+        "search_text": " ".join(terms),
+    })
+    return len(messages) - len(kept) if result.matched_count else 0
@@ -0,0 +1,210 @@
+"""In-process cache of recently active chat documents.
+
+An active chat is read on every message and every time it is opened, seconds
+apart. The cache keeps the most recently used chat documents (without their
+messages, which live in their own collection) in an LRU bounded by an estimate
+of their memory use, and is written through by the endpoints that change a
+chat, so a turn usually finds its chat already in memory.
+
+Every write to a chat document increments its ``version``. Other workers'
+writes are caught in one of two ways:
+
+- ``changestream``: a change stream on ``chats`` (replica sets only) drops
+  entries as soon as a newer version is written anywhere, and hits cost no
+  database round trip. If the stream cannot be opened or breaks, the cache
+  falls back to version checks.
+- ``version``: a hit reads back only the ``version`` field and is served when
+  it still matches, saving the transfer and decoding of the document but not
+  the round trip. An entry checked less than ``validity`` seconds ago is served
+  without a check, so other workers' writes may be seen that much later.
+
+``auto`` uses the change stream where the server supports one and version
+checks elsewhere.
+"""
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import bson
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Chats whose latest version is remembered from the change stream
+SEEN_VERSIONS = 10000
+
+DELETED = float("inf")
+
+
+def chat_version(chat: dict) -> int:
+    return chat.get('version', 0)
+
+
+class ChatCache:
+    def __init__(
+        self,
+        db,
+        max_bytes: int = 16 * 1024 * 1024,
+        invalidation: str = "auto",
+        validity: float = 0,
+    ):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.invalidation = invalidation
+        self.validity = validity
+        # chat id -> (document, estimated bytes), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # chat id -> when its entry was last known to be current
+        self._checked: Dict[str, float] = {}
+        # Mongo _id -> chat id, for change events
+        self._ids: Dict[object, str] = {}
+        # chat id -> newest version seen in the change stream
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._watching = False
+        self._task: Optional[asyncio.Task] = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def start(self):
+        if self.invalidation in ("changestream", "auto"):
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def get(self, chat_id: str) -> Optional[dict]:
+        """The chat document, from the cache when it is current (``None`` if the chat does not exist)"""
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            chat = entry[0]
+            now = time.monotonic()
+            if self._watching or now - self._checked.get(chat_id, float("-inf")) < self.validity:
+                current = True
+            else:
+                stored = await self.db.chats.find_one({"id": chat_id}, {"_id": 0, "version": 1})
+                current = stored is not None and chat_version(stored) == chat_version(chat)
+            if current and self._entries.get(chat_id) is entry:
+                self._entries.move_to_end(chat_id)
+                self._checked[chat_id] = now
+                self.hits += 1
+                return copy.copy(chat)
+            self.stale += 1
+            self.discard(chat_id)
+
+        self.misses += 1
+        chat = await self.db.chats.find_one({"id": chat_id})
+        if chat is not None and 'messages' not in chat:
+            # Legacy chats are cached once migrated
+            self.put(chat)
+        return chat
+
+    def put(self, chat: dict):
+        """Store the latest known state of a chat"""
+        chat_id = chat['id']
+        if self._seen.get(chat_id, -1) > chat_version(chat):
+            # A newer write was already seen
+            return
+        self.discard(chat_id)
+        chat = {k: v for k, v in chat.items() if k != 'messages'}
+        size = len(bson.encode(chat))
+        if size > self.max_bytes:
+            return
+        self._entries[chat_id] = (chat, size)
+        self._checked[chat_id] = time.monotonic()
+        if '_id' in chat:
+            self._ids[chat['_id']] = chat_id
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._forget(*evicted)
+            self.evictions += 1
+
+    def _forget(self, chat: dict, size: int):
+        self._ids.pop(chat.get('_id'), None)
+        self._checked.pop(chat['id'], None)
+        self.bytes -= size
+
+    def discard(self, chat_id: str):
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self._forget(*entry)
+
+    def clear(self):
+        self._entries.clear()
+        self._ids.clear()
+        self._checked.clear()
+        self.bytes = 0
+
+    def _saw(self, chat_id: str, version: float):
+        self._seen[chat_id] = max(version, self._seen.get(chat_id, -1))
+        self._seen.move_to_end(chat_id)
+        while len(self._seen) > SEEN_VERSIONS:
+            self._seen.popitem(last=False)
+
+    def _apply_change(self, change: dict):
+        key = change['documentKey']['_id']
+        # New chats use their id as _id
+        chat_id = self._ids.get(key, key if isinstance(key, str) else None)
+        if change['operationType'] == "delete":
+            if chat_id:
+                self._saw(chat_id, DELETED)
+                self.discard(chat_id)
+            return
+        if change['operationType'] == "replace":
+            document = change.get('fullDocument') or {}
+            chat_id = document.get('id', chat_id)
+            version = chat_version(document)
+        else:
+            version = change.get('updateDescription', {}).get('updatedFields', {}).get('version')
+        if chat_id is None:
+            return
+        if version is None:
+            # A write that does not bump the version: never trust the entry
+            self.discard(chat_id)
+            return
+        self._saw(chat_id, version)
+        entry = self._entries.get(chat_id)
+        if entry is not None and chat_version(entry[0]) < version:
+            self.discard(chat_id)
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+        try:
+            async with self.db.chats.watch(pipeline) as stream:
+                # Entries cached before the stream opened may have missed writes
+                self.clear()
+                self._watching = True
+                logger.info("Chat cache invalidated by a change stream")
+                async for change in stream:
+                    self._apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except (PyMongoError, NotImplementedError) as e:
+            log = logger.info if self.invalidation == "auto" else logger.warning
+            log(f"Chat cache change stream unavailable, checking versions instead: {str(e)}")
+        finally:
+            self._watching = False
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "invalidation": "changestream" if self._watching else "version",
+            "validity_seconds": self.validity,
+            "size": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,252 @@
+"""Bulk export and import of chats and messages as NDJSON.
+
+Exports stream documents straight from a Mongo cursor, one JSON object per
+line, optionally gzip-compressed, so memory use does not depend on the size of
+the collection. Imports read the request body incrementally, accept the same
+format (gzip is detected from the data), validate every record and write them
+in batches of upserts keyed by ``id``. Importing the same file twice leaves
+chats and messages as they were, except for the chat ``version``, which is
+bumped so that cached copies are refreshed. Message exports include the
+compressed histories of archived chats.
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from arabic_text import search_text
+from chat_archive import decode_archive
+from message_store import message_doc
+
+# Internal fields left out of exports and recomputed on import
+EXPORT_PROJECTIONS = {
+    "chats": {"_id": 0, "search_title": 0, "messages": 0, "version": 0},
+    "messages": {"_id": 0, "search_text": 0, "stored_at": 0, "job_id": 0},
+}
+
+DATETIME_FIELDS = {
+    "chats": ("created_at", "updated_at"),
+    "messages": ("timestamp",),
+}
+
+# Required fields of imported records and their types
+REQUIRED_FIELDS = {
+    "chats": {"id": str, "title": str, "created_at": datetime, "updated_at": datetime},
+    "messages": {"id": str, "chat_id": str, "seq": int, "role": str, "content": str, "timestamp": datetime},
+}
+
+ROLES = ("user", "assistant")
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+MAX_ERROR_SAMPLES = 10
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def export_query(kind: str, since: Optional[datetime]):
+    """Filter and sort order of an export"""
+    if kind == "chats":
+        query = {"updated_at": {"$gte": since}} if since else {}
+        return query, [("updated_at", 1), ("id", 1)]
+    query = {"timestamp": {"$gte": since}} if since else {}
+    # Follows the (chat_id, seq) index
+    return query, [("chat_id", 1), ("seq", 1)]
+
+
+async def export_ndjson(
+    db,
+    kind: str,
+    since: Optional[datetime] = None,
+    batch_size: int = 500,
+) -> AsyncIterator[bytes]:
+    """Yield the documents of a collection as NDJSON, one cursor batch per chunk"""
+    query, sort = export_query(kind, since)
+    cursor = db[kind].find(query, EXPORT_PROJECTIONS[kind]).sort(sort).batch_size(batch_size)
+    lines = []
+    async for doc in cursor:
+        lines.append(json.dumps(doc, ensure_ascii=False, default=_json_default))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+
+    if kind == "messages":
+        # Archived histories follow, one chat at a time
+        async for archive in db.chat_archives.find({}).batch_size(10):
+            for message in decode_archive(archive):
+                if since and message['timestamp'] < since:
+                    continue
+                doc = {**message, "chat_id": archive['chat_id']}
+                lines.append(json.dumps(doc, ensure_ascii=False, default=_json_default))
+            if len(lines) >= batch_size:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a (possibly gzip-compressed) byte stream into lines"""
+    decompressor = None
+    pending = b""
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(31)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if decompressor is not None:
+        pending += decompressor.flush()
+    if pending:
+        yield pending
+
+
+def _parse_datetime(field: str, value) -> datetime:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            raise InvalidRecord(f"{field} is not an ISO datetime")
+    if not isinstance(value, datetime):
+        raise InvalidRecord(f"{field} is not an ISO datetime")
+    if value.tzinfo is not None:
+        # Stored datetimes are naive UTC
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def import_doc(kind: str, record: dict) -> dict:
+    """Validate an exported record and build the document to store"""
+    if not isinstance(record, dict):
+        raise InvalidRecord("not a JSON object")
+    required = REQUIRED_FIELDS[kind]
+    missing = [field for field in required if record.get(field) is None]
+    if missing:
+        raise InvalidRecord(f"missing {', '.join(missing)}")
+
+    doc = dict(record)
+    for field in DATETIME_FIELDS[kind]:
+        doc[field] = _parse_datetime(field, doc[field])
+    for field, expected in required.items():
+        # bool is an int subclass, but never a valid seq
+        if not isinstance(doc[field], expected) or isinstance(doc[field], bool):
+            raise InvalidRecord(f"{field} must be of type {expected.__name__}")
+    if not doc['id']:
+        raise InvalidRecord("id is empty")
+
+    if kind == "chats":
+        count = doc.get('message_count', 0)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise InvalidRecord("message_count must be a non-negative int")
+        doc['_id'] = doc['id']
+        doc['search_title'] = search_text(doc['title'])
+        return doc
+
+    if doc['seq'] < 0:
+        raise InvalidRecord("seq must not be negative")
+    if doc['role'] not in ROLES:
+        raise InvalidRecord(f"role must be one of {', '.join(ROLES)}")
+    return message_doc(doc.pop('chat_id'), doc.pop('seq'), doc)
+
+
+def upsert_operation(kind: str, doc: dict) -> UpdateOne:
+    """Write an imported record, leaving an identical stored one untouched"""
+    fields = {k: v for k, v in doc.items() if k not in ('_id', 'stored_at')}
+    if kind == "chats":
+        # Bump the version so cached copies of a replaced chat are refreshed
+        return UpdateOne({"_id": doc['_id']}, {"$set": fields, "$inc": {"version": 1}}, upsert=True)
+    # Messages are immutable: the write time of an existing one is kept
+    return UpdateOne(
+        {"_id": doc['_id']},
+        {"$set": fields, "$setOnInsert": {"stored_at": doc['stored_at']}},
+        upsert=True,
+    )
+
+
+class ImportResult:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors = 0
+        self.error_samples: List[Dict[str, object]] = []
+
+    def error(self, line: int, detail: str):
+        self.errors += 1
+        if len(self.error_samples) < MAX_ERROR_SAMPLES:
+            self.error_samples.append({"line": line, "detail": detail})
+
+    def dict(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "received": self.received,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "errors": self.errors,
+            "error_samples": self.error_samples,
+        }
+
+
+async def _write_batch(db, kind: str, batch: List[tuple], result: ImportResult):
+    operations = [upsert_operation(kind, doc) for _, doc in batch]
+    try:
+        outcome = await db[kind].bulk_write(operations, ordered=False)
+        details = outcome.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get('writeErrors', []):
+            result.error(batch[error['index']][0], error.get('errmsg', 'write error'))
+    result.inserted += details.get('nUpserted', 0)
+    result.updated += details.get('nModified', 0)
+
+
+async def import_ndjson(db, kind: str, chunks: AsyncIterator[bytes], batch_size: int = 500) -> ImportResult:
+    """Upsert NDJSON records into a collection in batches, skipping invalid lines"""
+    result = ImportResult(kind)
+    batch = []
+    line_number = 0
+    async for line in ndjson_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        result.received += 1
+        try:
+            batch.append((line_number, import_doc(kind, json.loads(line))))
+        except (ValueError, TypeError) as e:
+            result.error(line_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            await _write_batch(db, kind, batch, result)
+            batch = []
+    if batch:
+        await _write_batch(db, kind, batch, result)
+    return result
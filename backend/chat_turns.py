@@ -0,0 +1,91 @@
+"""Per-chat serialization of message turns.
+
+Turns on the same chat run one at a time, in arrival order, so each turn sees
+the messages stored by the previous one. Turns on different chats never wait
+for each other.
+
+A request repeating a turn that is still in flight (a client retrying a slow
+answer) joins that turn and gets its result instead of queueing a second LLM
+call, and the number of turns waiting on a single chat is bounded.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TurnQueueFull(Exception):
+    pass
+
+
+class ChatTurnQueue:
+    def __init__(self, max_pending: int = 8):
+        self.max_pending = max_pending
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pending: Dict[str, int] = {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.turns = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def pending(self, chat_id: str) -> int:
+        """Number of turns running or waiting on a chat"""
+        return self._pending.get(chat_id, 0)
+
+    async def run(self, chat_id: str, key: Optional[Hashable], turn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``turn`` once all earlier turns of the chat are done.
+
+        ``key`` identifies the turn for deduplication: while a turn with the
+        same key is in flight on the chat, callers share its result. ``None``
+        disables deduplication.
+        """
+        inflight_key = (chat_id, key)
+        if key is not None and inflight_key in self._inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self._inflight[inflight_key])
+
+        if self.pending(chat_id) >= self.max_pending:
+            self.rejected += 1
+            raise TurnQueueFull(f"Too many pending messages for chat {chat_id}")
+
+        result = None
+        if key is not None:
+            result = asyncio.get_running_loop().create_future()
+            # Nobody may be waiting on the shared result
+            result.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[inflight_key] = result
+
+        self._pending[chat_id] = self.pending(chat_id) + 1
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                self.turns += 1
+                value = await turn()
+            if result is not None:
+                result.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            if result is not None:
+                result.cancel()
+            raise
+        except Exception as e:
+            if result is not None:
+                result.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                del self._inflight[inflight_key]
+            self._pending[chat_id] -= 1
+            if not self._pending[chat_id]:
+                del self._pending[chat_id]
+                del self._locks[chat_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_chats": len(self._pending),
+            "pending_turns": sum(self._pending.values()),
+            "max_pending_per_chat": self.max_pending,
+            "turns": self.turns,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,149 @@
+"""Server-side conversation context under a token budget.
+
+The prompt history sent to the LLM is assembled from stored messages instead of
+relying on the in-memory history of an ``LlmChat`` session, so it survives
+restarts and stays bounded. The most recent turns are sent verbatim; older
+turns are folded into a rolling summary kept on the chat document as
+``summary: {"text", "upto_seq"}`` (messages with ``seq < upto_seq`` are covered).
+
+The summary is only recomputed when turns fall out of the window, and then the
+window is shrunk to half the budget, so the next turns fit again without
+another summarization call. It is recomputed in the background after a turn is
+stored, never while a turn waits for it; a turn sent before the summary caught
+up is answered with the turns that still fit the window.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Set
+
+from message_store import load_messages
+
+logger = logging.getLogger(__name__)
+
+ROLE_LABELS = {"user": "الطالب", "assistant": "فيصل"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+@dataclass
+class ConversationContext:
+    summary: Optional[str] = None
+    messages: List[dict] = field(default_factory=list)
+
+    def render(self, system_message: str) -> str:
+        """System message extended with the summary and recent turns"""
+        parts = [system_message]
+        if self.summary:
+            parts.append(f"ملخص المحادثة السابقة:\n{self.summary}")
+        if self.messages:
+            transcript = "\n".join(
+                f"{ROLE_LABELS.get(m['role'], m['role'])}: {m['content']}" for m in self.messages
+            )
+            parts.append(f"آخر الرسائل في المحادثة:\n{transcript}")
+        return "\n\n".join(parts)
+
+
+Summarizer = Callable[[Optional[str], List[dict]], Awaitable[str]]
+
+
+class ContextBuilder:
+    def __init__(
+        self,
+        db,
+        token_budget: int,
+        summarize: Summarizer,
+        summary_tokens: int = 500,
+        max_messages: int = 200,
+    ):
+        self.db = db
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.max_messages = max_messages
+        self.summarizations = 0
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def window_tokens(self) -> int:
+        return max(self.token_budget - self.summary_tokens, 0)
+
+    @staticmethod
+    def _window_start(messages: List[dict], budget: int) -> int:
+        """Index of the oldest message such that it and everything after fit in ``budget``"""
+        used = 0
+        for i in range(len(messages) - 1, -1, -1):
+            used += estimate_tokens(messages[i]['content'])
+            if used > budget:
+                return i + 1
+        return 0
+
+    async def _unsummarized(self, chat: dict) -> List[dict]:
+        """Stored messages of ``chat`` not covered by its summary"""
+        upto_seq = (chat.get('summary') or {}).get('upto_seq', 0)
+        messages = await load_messages(self.db, chat, limit=self.max_messages)
+        return [m for m in messages if m['seq'] >= upto_seq]
+
+    async def build(self, chat: dict) -> ConversationContext:
+        """Assemble the context for the next turn of ``chat``"""
+        messages = await self._unsummarized(chat)
+        start = self._window_start(messages, self.window_tokens)
+        return ConversationContext((chat.get('summary') or {}).get('text'), messages[start:])
+
+    def schedule_refresh(self, chat_id: str):
+        """Bring the summary of a chat up to date in the background"""
+        if chat_id in self._refreshing:
+            return
+        self._refreshing.add(chat_id)
+        task = asyncio.create_task(self._refresh(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, chat_id: str):
+        try:
+            await self.refresh(chat_id)
+        except Exception as e:
+            logger.error(f"Error summarizing chat {chat_id}: {str(e)}")
+        finally:
+            self._refreshing.discard(chat_id)
+
+    async def refresh(self, chat_id: str) -> bool:
+        """Fold the turns that fell out of the window into the summary, returning whether it changed"""
+        chat = await self.db.chats.find_one({"id": chat_id}, {"_id": 0, "id": 1, "summary": 1})
+        if chat is None:
+            return False
+        summary = chat.get('summary') or {}
+        messages = await self._unsummarized(chat)
+        if self._window_start(messages, self.window_tokens) == 0:
+            return False
+
+        # Keep only half a window so the next few turns fit without summarizing again
+        start = self._window_start(messages, self.window_tokens // 2)
+        start = min(start, len(messages) - 1)
+        dropped = messages[:start]
+        summary_text = await self.summarize(summary.get('text'), dropped)
+        summary_text = summary_text[: self.summary_tokens * 4]
+        self.summarizations += 1
+
+        # Only store the summary if no other worker moved it forward already
+        result = await self.db.chats.update_one(
+            {"id": chat_id, "summary.upto_seq": summary.get('upto_seq')},
+            {"$set": {"summary": {"text": summary_text, "upto_seq": messages[start]['seq']}}, "$inc": {"version": 1}},
+        )
+        return bool(result.modified_count)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "token_budget": self.token_budget,
+            "summary_tokens": self.summary_tokens,
+            "summarizations": self.summarizations,
+        }
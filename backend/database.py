@@ -0,0 +1,158 @@
+"""MongoDB client configuration, indexes and readiness.
+
+Connection pool size, timeouts and wire compression are read from the
+environment:
+
+- ``MONGO_MAX_POOL_SIZE`` (default 100) and ``MONGO_MIN_POOL_SIZE`` (default 0)
+- ``MONGO_MAX_IDLE_TIME_MS`` (default 60000)
+- ``MONGO_SERVER_SELECTION_TIMEOUT_MS`` (default 5000)
+- ``MONGO_CONNECT_TIMEOUT_MS`` (default 5000)
+- ``MONGO_SOCKET_TIMEOUT_MS`` (default 0, no timeout)
+- ``MONGO_COMPRESSORS``, e.g. ``zstd,snappy,zlib`` (default none)
+
+The client is created on first use of the database (see ``LazyDatabase``), so
+importing the server neither imports motor nor resolves the Mongo host.
+
+A ``mongomock://`` URL runs against an in-memory stand-in (requires the
+``mongomock-motor`` package), for local benchmarks without a Mongo server.
+"""
+import asyncio
+import logging
+import os
+from typing import Callable
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Indexes needed by the queries of each collection
+INDEXES = {
+    "chats": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Chat list ordering and keyset pagination
+        IndexModel([("updated_at", DESCENDING), ("id", DESCENDING)]),
+        # Title search; normalization is done by the app, not by a language
+        IndexModel([("search_title", TEXT)], default_language="none"),
+    ],
+    "messages": [
+        # Message history of a chat, in order
+        IndexModel([("chat_id", ASCENDING), ("seq", ASCENDING)], unique=True),
+        # Message search
+        IndexModel([("search_text", TEXT)], default_language="none"),
+        # Turns stored by a message job, checked before a recovered job runs again
+        IndexModel([("job_id", ASCENDING)], partialFilterExpression={"job_id": {"$exists": True}}),
+    ],
+    "chat_archives": [
+        # Search in archived chat histories
+        IndexModel([("search_text", TEXT)], default_language="none"),
+    ],
+    "message_jobs": [
+        # One job per idempotency key and chat
+        IndexModel(
+            [("chat_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$exists": True}},
+        ),
+        # Queued jobs recovered at startup
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        # Mongo removes jobs once their result is no longer kept
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "chat_tombstones": [
+        # Deletions since a sync token
+        IndexModel([("deleted_at", ASCENDING)]),
+        # Mongo removes tombstones once no valid sync token can predate them
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+def mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '60000')),
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    }
+    socket_timeout = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '0'))
+    if socket_timeout:
+        options["socketTimeoutMS"] = socket_timeout
+    compressors = os.environ.get('MONGO_COMPRESSORS')
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+
+def create_mongo_client(mongo_url: str, **options):
+    """Create the Mongo client with the configured pool settings"""
+    if mongo_url.startswith("mongomock://"):
+        from mongomock_motor import AsyncMongoMockClient
+        return AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(mongo_url, **{**mongo_client_options(), **options})
+
+
+class LazyDatabase:
+    """A Mongo database whose client is created by ``connect`` on first use.
+
+    Attribute and item access (``db.chats``, ``db["chats"]``, ``db.command``)
+    is forwarded to the motor database.
+    """
+
+    def __init__(self, connect: Callable[[], object], name: str):
+        self._connect = connect
+        self._name = name
+        self._client = None
+        self._database = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._connect()
+            self._database = self._client[self._name]
+        return self._client
+
+    @property
+    def database(self):
+        if self._database is None:
+            self.client
+        return self._database
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+
+async def ensure_indexes(db):
+    """Create the indexes the API relies on (no-op when they already exist)"""
+    for collection, indexes in INDEXES.items():
+        await db[collection].create_indexes(indexes)
+
+
+async def ping(db) -> bool:
+    try:
+        await db.command("ping")
+        return True
+    except Exception as e:
+        logger.warning(f"MongoDB ping failed: {str(e)}")
+        return False
+
+
+async def prepare_database(db, retry_delay: float = 2.0, max_delay: float = 30.0):
+    """Wait for the database to answer and its indexes to exist, retrying with backoff"""
+    while True:
+        try:
+            await db.command("ping")
+            await ensure_indexes(db)
+            return
+        except Exception as e:
+            logger.error(f"Database not ready, retrying in {retry_delay:.0f}s: {str(e)}")
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, max_delay)
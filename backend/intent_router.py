@@ -0,0 +1,120 @@
+"""Keyword routing of messages to AI routes.
+
+Keywords from every rule are compiled into a single Aho-Corasick automaton, so
+a message is normalized once and classified in one pass over its characters,
+however many keywords the rule table holds. Each matched keyword adds its
+rule's weight to the rule's route; the highest score wins, ties go to the
+route with the higher priority, and messages without matches use the default
+route.
+"""
+import json
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Sequence
+
+from arabic_text import normalize_arabic
+
+
+@dataclass(frozen=True)
+class RoutingRule:
+    route: str
+    keywords: Sequence[str]
+    weight: float = 1.0
+    priority: int = 0
+
+
+DEFAULT_RULES = [
+    RoutingRule(
+        "educational",
+        ['رياضيات', 'فيزياء', 'كيمياء', 'تاريخ', 'جغرافيا', 'دراسة', 'واجب', 'امتحان'],
+        priority=2,
+    ),
+    RoutingRule(
+        "creative",
+        ['قصة', 'شعر', 'إبداع', 'كتابة', 'تأليف', 'فن'],
+        priority=1,
+    ),
+]
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton reporting which keywords occur in a text"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for index, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = next_node
+            self._out[node].append(index)
+
+        # Breadth-first pass linking every node to its longest proper suffix
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def matches(self, text: str) -> set:
+        """Indices of the keywords found in ``text``"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class IntentRouter:
+    def __init__(self, rules: Sequence[RoutingRule] = DEFAULT_RULES, default_route: str = "general"):
+        self.rules = list(rules)
+        self.default_route = default_route
+        self.priorities: Dict[str, int] = {}
+        keywords = []
+        # keyword index -> (route, weight)
+        self._targets = []
+        for rule in self.rules:
+            self.priorities[rule.route] = max(rule.priority, self.priorities.get(rule.route, rule.priority))
+            for keyword in rule.keywords:
+                keywords.append(normalize_arabic(keyword))
+                self._targets.append((rule.route, rule.weight))
+        self._automaton = KeywordAutomaton(keywords)
+
+    @classmethod
+    def from_file(cls, path: str, default_route: str = "general") -> "IntentRouter":
+        """Load rules from a JSON list of ``{"route", "keywords", "weight", "priority"}``"""
+        with open(path, encoding="utf-8") as f:
+            rules = [RoutingRule(**rule) for rule in json.load(f)]
+        return cls(rules, default_route)
+
+    def scores(self, text: str) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for index in self._automaton.matches(normalize_arabic(text)):
+            route, weight = self._targets[index]
+            scores[route] = scores.get(route, 0) + weight
+        return scores
+
+    def classify(self, text: str) -> str:
+        scores = self.scores(text)
+        if not scores:
+            return self.default_route
+        return max(scores, key=lambda route: (scores[route], self.priorities[route]))
@@ -0,0 +1,158 @@
+"""Admission control for LLM calls.
+
+Each provider gets a concurrency limit. Calls over the limit wait in a bounded
+FIFO queue for at most a queue-time budget; when the queue is full, or the
+budget runs out, the call is rejected right away with a retry hint instead of
+piling more load onto a provider that is already saturated. Admitted calls thus
+keep a predictable latency under overload.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+import metrics
+
+
+class AdmissionRejected(Exception):
+    """A call was not admitted to a provider"""
+
+    def __init__(self, provider: str, reason: str, retry_after: int):
+        self.provider = provider
+        self.reason = reason  # 'queue_full' or 'queue_timeout'
+        self.retry_after = retry_after
+        super().__init__(f"{provider} is overloaded ({reason})")
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._hold_time = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time = 0.0
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new call"""
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._hold_time * backlog / self.max_concurrency))
+
+    async def acquire(self):
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            metrics.llm_admission_rejections.inc(self.provider, "queue_full")
+            raise AdmissionRejected(self.provider, "queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            metrics.llm_admission_rejections.inc(self.provider, "queue_timeout")
+            raise AdmissionRejected(self.provider, "queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.wait_time += waited
+            metrics.llm_queue_wait.observe(self.provider, value=waited)
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self, held: Optional[float] = None):
+        if held is not None:
+            self._hold_time = 0.9 * self._hold_time + 0.1 * held
+        # Hand the slot over to the oldest waiter still waiting
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": self.wait_time / self.queued if self.queued else 0.0,
+        }
+
+
+class AdmissionController:
+    """Per-provider limiters; a concurrency limit of 0 admits every call"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        provider_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.provider_limits = provider_limits or {}
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> Optional[ProviderLimiter]:
+        limit = self.provider_limits.get(provider, self.max_concurrency)
+        if not limit:
+            return None
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limiter = self._limiters[provider] = ProviderLimiter(
+                provider, limit, self.max_queue, self.queue_timeout,
+            )
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        """Hold one of the provider's call slots, waiting in its queue if needed"""
+        limiter = self.limiter(provider)
+        if limiter is None:
+            yield
+            return
+
+        await limiter.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            limiter.release(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {provider: limiter.stats() for provider, limiter in self._limiters.items()}
+
+    def collect(self):
+        """Metrics collector exporting the limiter stats as gauges"""
+        for provider, stats in self.stats().items():
+            for key, value in stats.items():
+                metrics.llm_admission.set(provider, key, value=value)
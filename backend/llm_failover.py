@@ -0,0 +1,225 @@
+"""Provider failover and hedged requests for AI routes.
+
+Each chat type has a chain of provider/model targets, tried in order. Every
+attempt has a deadline; when an attempt fails or runs out of time the next
+target in the chain is tried. With hedging enabled, if the current attempt has
+not answered by the p95 latency observed for its target, one extra attempt is
+started on the next target and whichever answers first wins; the other is
+cancelled. Only the slowest ~5% of calls are hedged, so average cost barely
+changes while tail latency drops.
+
+Streamed replies fail over only until the first token arrives, since tokens
+already sent to the client cannot be taken back.
+
+Every attempt first takes a slot from the provider's admission control; a
+provider that turns the call away is failed over like any other error.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional
+
+import metrics
+from llm_admission import AdmissionController, AdmissionRejected
+
+
+@dataclass(frozen=True)
+class LlmTarget:
+    provider: str
+    model: str
+
+
+@dataclass
+class RoutePolicy:
+    chain: List[LlmTarget]
+    attempt_timeout: float = 45.0
+    hedge: bool = False
+
+
+class LlmUnavailable(Exception):
+    """Every target of a route failed"""
+
+    def __init__(self, chat_type: str, errors: List[BaseException]):
+        self.chat_type = chat_type
+        self.errors = errors
+        self.timed_out = bool(errors) and all(isinstance(e, asyncio.TimeoutError) for e in errors)
+        # Every provider was overloaded rather than failing
+        self.rejected = bool(errors) and all(isinstance(e, AdmissionRejected) for e in errors)
+        super().__init__(f"No AI provider answered for {chat_type}: {[repr(e) for e in errors]}")
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per target"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Dict[LlmTarget, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, target: LlmTarget, seconds: float):
+        self._samples[target].append(seconds)
+
+    def percentile(self, target: LlmTarget, pct: float) -> Optional[float]:
+        samples = self._samples.get(target)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# Creates the AI chat client for a target; the flag is set for the first target of the chain
+ChatFactory = Callable[[LlmTarget, bool], object]
+
+
+class LlmRouter:
+    def __init__(
+        self,
+        policies: Dict[str, RoutePolicy],
+        hedge_percentile: float = 95,
+        tracker: LatencyTracker = None,
+        admission: AdmissionController = None,
+    ):
+        self.policies = policies
+        self.admission = admission or AdmissionController(max_concurrency=0)
+        self.hedge_percentile = hedge_percentile
+        self.tracker = tracker or LatencyTracker()
+        self.failovers = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def policy(self, chat_type: str) -> RoutePolicy:
+        return self.policies.get(chat_type) or self.policies["general"]
+
+    def _fail_over(self, chat_type: str, target: LlmTarget, error: BaseException):
+        self.failovers += 1
+        if isinstance(error, asyncio.TimeoutError):
+            reason = "timeout"
+        elif isinstance(error, AdmissionRejected):
+            reason = "rejected"
+        else:
+            reason = "error"
+        metrics.llm_failovers.inc(chat_type, target.provider, reason)
+
+    async def _attempt(self, chat_type: str, target: LlmTarget, chat, user_message, timeout: float) -> str:
+        async with self.admission.slot(target.provider):
+            start = time.perf_counter()
+            with metrics.LlmCallTimer(chat_type, target.provider, target.model):
+                response = await asyncio.wait_for(chat.send_message(user_message), timeout)
+            self.tracker.record(target, time.perf_counter() - start)
+        return response
+
+    async def send(self, chat_type: str, make_chat: ChatFactory, user_message) -> str:
+        """Get a complete reply, failing over and hedging along the route's chain"""
+        policy = self.policy(chat_type)
+        chain = policy.chain
+        errors: List[BaseException] = []
+        running: Dict[asyncio.Task, LlmTarget] = {}
+        next_index = 0
+        hedged = None
+
+        def start_next():
+            nonlocal next_index
+            target = chain[next_index]
+            chat = make_chat(target, next_index == 0)
+            task = asyncio.create_task(self._attempt(chat_type, target, chat, user_message, policy.attempt_timeout))
+            running[task] = target
+            next_index += 1
+            return task
+
+        start_next()
+        try:
+            while running:
+                hedge_delay = None
+                if policy.hedge and hedged is None and len(running) == 1 and next_index < len(chain):
+                    hedge_delay = self.tracker.percentile(next(iter(running.values())), self.hedge_percentile)
+
+                done, _ = await asyncio.wait(running, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The current attempt is slower than usual: race it against the next target
+                    self.hedges += 1
+                    hedged = start_next()
+                    continue
+
+                for task in done:
+                    target = running.pop(task)
+                    if task.exception() is None:
+                        if hedged is not None:
+                            won = task is hedged
+                            self.hedges_won += won
+                            metrics.llm_hedges.inc(chat_type, "won" if won else "lost")
+                        return task.result()
+                    errors.append(task.exception())
+                    if next_index < len(chain) or running:
+                        self._fail_over(chat_type, target, task.exception())
+
+                if not running and next_index < len(chain):
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise LlmUnavailable(chat_type, errors)
+
+    async def stream(
+        self,
+        chat_type: str,
+        make_chat: ChatFactory,
+        user_message,
+        stream_reply: Callable[[object, object], AsyncIterator[str]],
+    ) -> AsyncIterator[str]:
+        """Stream a reply, failing over to the next target until the first token arrives.
+
+        ``attempt_timeout`` bounds the wait for every token, so a stream that
+        stalls after its first token fails instead of holding the turn.
+        """
+        policy = self.policy(chat_type)
+        errors: List[BaseException] = []
+        for index, target in enumerate(policy.chain):
+            tokens = stream_reply(make_chat(target, index == 0), user_message).__aiter__()
+            started = False
+            try:
+                async with self.admission.slot(target.provider):
+                    with metrics.LlmCallTimer(chat_type, target.provider, target.model) as timer:
+                        while True:
+                            try:
+                                token = await asyncio.wait_for(tokens.__anext__(), policy.attempt_timeout)
+                            except StopAsyncIteration:
+                                return
+                            if not started:
+                                started = True
+                                timer.first_token()
+                            yield token
+            except Exception as e:
+                await tokens.aclose()
+                if started:
+                    raise
+                errors.append(e)
+                if index + 1 < len(policy.chain):
+                    self._fail_over(chat_type, target, e)
+
+        raise LlmUnavailable(chat_type, errors)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "hedge_delays_seconds": {
+                chat_type: self.tracker.percentile(policy.chain[0], self.hedge_percentile)
+                for chat_type, policy in self.policies.items()
+            },
+        }
+
+
+def load_policies(defaults: Dict[str, RoutePolicy], overrides: Optional[dict]) -> Dict[str, RoutePolicy]:
+    """Apply JSON overrides ``{chat_type: {"chain": [[provider, model], ...], "attempt_timeout", "hedge"}}``"""
+    policies = dict(defaults)
+    for chat_type, override in (overrides or {}).items():
+        base = policies.get(chat_type) or policies["general"]
+        chain = [LlmTarget(*target) for target in override["chain"]] if "chain" in override else base.chain
+        policies[chat_type] = RoutePolicy(
+            chain=chain,
+            attempt_timeout=float(override.get("attempt_timeout", base.attempt_timeout)),
+            hedge=bool(override.get("hedge", base.hedge)),
+        )
+    return policies
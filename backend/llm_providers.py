@@ -0,0 +1,113 @@
+"""LLM client backends.
+
+By default chats go through ``emergentintegrations``. Setting
+``LLM_PROVIDER=fake`` swaps in ``FakeLlmChat``, a local stand-in with the same
+interface that answers offline with configurable latency and token rate, so
+the API (including streaming) can be exercised without network access or keys.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List
+
+
+class FakeUserMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeLlmChat:
+    """Offline replacement for ``LlmChat``.
+
+    Latency is controlled by ``FAKE_LLM_LATENCY_MS`` (time to first token) and
+    ``FAKE_LLM_TOKENS_PER_SEC`` (0 means no delay between tokens). Like the real
+    client, it keeps the conversation history of each ``session_id``.
+    """
+
+    def __init__(self, api_key: str = None, session_id: str = None, system_message: str = None):
+        self.api_key = api_key
+        self.session_id = session_id
+        self.system_message = system_message
+        self.provider = "fake"
+        self.model = "fake"
+        self.latency = float(os.environ.get('FAKE_LLM_LATENCY_MS', '50')) / 1000
+        self.tokens_per_sec = float(os.environ.get('FAKE_LLM_TOKENS_PER_SEC', '50'))
+        self.histories: Dict[str, List[str]] = {}
+
+    def with_model(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        return self
+
+    def _reply_tokens(self, text: str):
+        reply = f"هذا رد تجريبي من {self.provider}/{self.model} على: {text}"
+        words = reply.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    async def stream_message(self, user_message) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        delay = 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0
+        tokens = self._reply_tokens(user_message.text)
+        for i, token in enumerate(tokens):
+            if i and delay:
+                await asyncio.sleep(delay)
+            yield token
+        self.histories.setdefault(self.session_id, []).extend([user_message.text, "".join(tokens)])
+
+    async def send_message(self, user_message) -> str:
+        return "".join([token async for token in self.stream_message(user_message)])
+
+
+class LlmBackend:
+    """The ``LlmChat`` and ``UserMessage`` classes selected by ``LLM_PROVIDER``.
+
+    The provider package is only imported on first use (or by ``load`` during
+    warm-up), so it does not slow down process start.
+    """
+
+    def __init__(self, provider: str = None):
+        self.provider = provider or os.environ.get('LLM_PROVIDER', 'emergent')
+        self._classes = None
+
+    def load(self):
+        if self._classes is None:
+            if self.provider == 'fake':
+                self._classes = (FakeLlmChat, FakeUserMessage)
+            else:
+                from emergentintegrations.llm.chat import LlmChat, UserMessage
+                self._classes = (LlmChat, UserMessage)
+        return self._classes
+
+    @property
+    def LlmChat(self):
+        return self.load()[0]
+
+    @property
+    def UserMessage(self):
+        return self.load()[1]
+
+
+def start_turn(chat, session_id: str, system_message: str):
+    """Point a reused client at a new session whose only context is ``system_message``.
+
+    Clients keep their conversation history per ``session_id``, so a fresh
+    session per turn sends the context built for the turn and nothing else,
+    while the client itself is kept.
+    """
+    chat.session_id = session_id
+    chat.system_message = system_message
+
+
+async def stream_reply(chat, user_message) -> AsyncIterator[str]:
+    """Yield the reply to ``user_message`` as it is generated.
+
+    Clients without native streaming support answer in a single chunk once the
+    whole reply is generated. ``emergentintegrations``' ``LlmChat`` has no
+    ``stream_message``, so real providers currently take this path.
+    """
+    stream = getattr(chat, 'stream_message', None)
+    if stream is None:
+        yield await chat.send_message(user_message)
+        return
+
+    async for token in stream(user_message):
+        yield token
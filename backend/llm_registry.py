@@ -0,0 +1,82 @@
+"""Registry of reusable LLM clients.
+
+Building an ``LlmChat`` per message throws away the client, its conversation
+state and its HTTP connections after every turn. The registry keeps one client
+per ``(chat_type, session_id)`` so consecutive turns of a chat reuse it, with
+a size cap (least recently used clients are evicted first) and an idle TTL.
+"""
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+
+class LlmClientRegistry:
+    def __init__(
+        self,
+        factory: Callable[[str, str], object],
+        max_size: int = 1000,
+        idle_ttl: float = 1800,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        # key -> (client, last used), least recently used first
+        self._clients: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def get(self, chat_type: str, session_id: str):
+        """Return the client for a chat session, creating it on first use"""
+        now = self.clock()
+        self._expire_idle(now)
+
+        key = (chat_type, session_id)
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._clients[key] = (entry[0], now)
+            self._clients.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        client = self.factory(chat_type, session_id)
+        self._clients[key] = (client, now)
+        while len(self._clients) > self.max_size:
+            self._clients.popitem(last=False)
+            self.evictions += 1
+        return client
+
+    def discard(self, chat_type: Optional[str] = None, session_id: Optional[str] = None):
+        """Drop cached clients matching a chat type and/or session"""
+        for key in list(self._clients):
+            if (chat_type is None or key[0] == chat_type) and (session_id is None or key[1] == session_id):
+                del self._clients[key]
+
+    def _expire_idle(self, now: float):
+        # Entries are ordered by last use, so idle ones are at the front
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+            self.expirations += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "idle_ttl_seconds": self.idle_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
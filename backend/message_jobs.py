@@ -0,0 +1,284 @@
+"""Asynchronous message jobs.
+
+In job mode a message is stored as a job document in the ``message_jobs``
+collection and acknowledged at once; the turn is answered by a bounded pool of
+worker tasks and its result (the updated chat, or an error) is stored on the
+job, where clients fetch it with a long poll. A connection dropped on a mobile
+network therefore loses nothing, and a client retrying with the same
+idempotency key gets the existing job back instead of a second LLM call.
+
+Workers claim a job atomically before running it and hold a lease on it,
+renewed while the turn runs. Jobs left queued, or running under an expired
+lease (a worker that crashed or was killed), are recovered and run again; the
+messages of a turn carry the id of the job that stored them, so a job whose
+turn was already stored is completed from it without a second LLM call.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PENDING = ("queued", "running")
+
+# How often a long poll rereads a job answered by another process
+POLL_INTERVAL = 0.5
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobFailed(Exception):
+    """A turn that failed with an error meant for the client"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def job_payload(job: dict) -> dict:
+    """A stored job in the response shape"""
+    return {
+        "id": job['id'],
+        "chat_id": job['chat_id'],
+        "status": job['status'],
+        "result": job.get('result'),
+        "error": job.get('error'),
+        "created_at": job['created_at'],
+        "completed_at": job.get('completed_at'),
+    }
+
+
+class MessageJobs:
+    def __init__(
+        self,
+        db,
+        handler: Callable[[dict], Awaitable[dict]],
+        workers: int = 4,
+        max_queue: int = 100,
+        result_ttl: float = 86400,
+        lease: float = 60,
+    ):
+        self.db = db
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = timedelta(seconds=result_ttl)
+        self.lease = lease
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._done: Dict[str, asyncio.Event] = {}
+        self._tasks = []
+        self.running = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.recovered = 0
+
+    def start(self):
+        # Queued ids and events belong to the loop the workers run on
+        self._queue = asyncio.Queue()
+        self._done = {}
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _existing(self, chat_id: str, key: str) -> Optional[dict]:
+        return await self.db.message_jobs.find_one({"chat_id": chat_id, "idempotency_key": key})
+
+    async def submit(
+        self, chat_id: str, content: str, key: Optional[str], limit: Optional[int],
+    ) -> Tuple[dict, bool]:
+        """Store and enqueue a job, or return the job already stored under ``key``.
+
+        Returns the job and whether it was created.
+        """
+        if key is not None:
+            existing = await self._existing(chat_id, key)
+            if existing:
+                self.deduplicated += 1
+                return existing, False
+
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise JobQueueFull("Too many queued messages, please retry shortly")
+
+        now = datetime.utcnow()
+        job_id = str(uuid.uuid4())
+        job = {
+            "_id": job_id,
+            "id": job_id,
+            "chat_id": chat_id,
+            "content": content,
+            "limit": limit,
+            "status": "queued",
+            "created_at": now,
+            "expires_at": now + self.result_ttl,
+        }
+        if key is not None:
+            job["idempotency_key"] = key
+        try:
+            await self.db.message_jobs.insert_one(job)
+        except DuplicateKeyError:
+            # A concurrent retry stored it first
+            self.deduplicated += 1
+            return await self._existing(chat_id, key), False
+
+        self.submitted += 1
+        self._enqueue(job_id)
+        return job, True
+
+    def _enqueue(self, job_id: str):
+        self._done.setdefault(job_id, asyncio.Event())
+        self._queue.put_nowait(job_id)
+
+    async def recover(self, startup: bool = False) -> int:
+        """Enqueue jobs whose worker is gone: running under an expired lease, or left queued.
+
+        Queued jobs of other processes are only taken over once they waited a
+        whole lease; at startup every queued job is taken.
+        """
+        now = datetime.utcnow()
+        recovered = 0
+        expired = self.db.message_jobs.find({"status": "running", "lease_until": {"$lt": now}}, {"id": 1})
+        async for job in expired:
+            result = await self.db.message_jobs.update_one(
+                {"_id": job['id'], "status": "running", "lease_until": {"$lt": now}},
+                {"$set": {"status": "queued"}},
+            )
+            if result.modified_count and job['id'] not in self._done:
+                self._enqueue(job['id'])
+                recovered += 1
+
+        query = {"status": "queued"}
+        if not startup:
+            query["created_at"] = {"$lt": now - timedelta(seconds=self.lease)}
+        async for job in self.db.message_jobs.find(query, {"id": 1}).sort("created_at", 1):
+            if job['id'] not in self._done:
+                self._enqueue(job['id'])
+                recovered += 1
+        if recovered:
+            self.recovered += recovered
+            logger.info(f"Recovered {recovered} message jobs")
+        return recovered
+
+    async def _recover_periodically(self):
+        while True:
+            await asyncio.sleep(self.lease)
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error(f"Error recovering message jobs: {str(e)}")
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await self.db.message_jobs.update_one(
+                {"_id": job_id, "status": "running"},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease)}},
+            )
+
+    async def _finish(self, job_id: str, fields: dict):
+        now = datetime.utcnow()
+        await self.db.message_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {**fields, "completed_at": now, "expires_at": now + self.result_ttl}},
+        )
+
+    async def _run(self, job_id: str):
+        now = datetime.utcnow()
+        job = await self.db.message_jobs.find_one_and_update(
+            {"_id": job_id, "status": "queued"},
+            {"$set": {
+                "status": "running",
+                "started_at": now,
+                "lease_until": now + timedelta(seconds=self.lease),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            # Claimed by another process, or expired
+            return
+        self.running += 1
+        renewal = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            result = await self.handler(job)
+        except asyncio.CancelledError:
+            # Shutting down: leave the job for the next run, which first checks
+            # whether this one stored the turn already
+            await self.db.message_jobs.update_one(
+                {"_id": job_id, "status": "running"}, {"$set": {"status": "queued"}},
+            )
+            raise
+        except JobFailed as e:
+            self.failed += 1
+            await self._finish(job_id, {"status": "failed", "error": {"status_code": e.status_code, "detail": e.detail}})
+        except Exception as e:
+            logger.error(f"Error in message job {job_id}: {str(e)}")
+            self.failed += 1
+            await self._finish(job_id, {"status": "failed", "error": {"status_code": 500, "detail": "Error processing message"}})
+        else:
+            self.completed += 1
+            await self._finish(job_id, {"status": "done", "result": result})
+        finally:
+            renewal.cancel()
+            self.running -= 1
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in message job {job_id}: {str(e)}")
+            finally:
+                event = self._done.pop(job_id, None)
+                if event:
+                    event.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """The job, once it is answered or after ``timeout`` seconds (``None`` if unknown)"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            job = await self.db.message_jobs.find_one({"_id": job_id})
+            remaining = deadline - asyncio.get_running_loop().time()
+            if job is None or job['status'] not in PENDING or remaining <= 0:
+                return job
+            event = self._done.get(job_id)
+            if event is None:
+                # Answered by another process
+                await asyncio.sleep(min(POLL_INTERVAL, remaining))
+                continue
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "recovered": self.recovered,
+        }
@@ -0,0 +1,198 @@
+"""Append-only message storage.
+
+Messages live in their own ``messages`` collection, one document per message,
+keyed by ``chat_id`` plus a per-chat ``seq`` number. The chat document only
+keeps a ``message_count`` counter which is bumped atomically with ``$inc`` to
+reserve sequence numbers, so the cost of a turn does not depend on how long the
+conversation already is.
+
+The history of idle chats may be moved to a compressed archive (see
+``chat_archive``); loading merges it back in, so callers never notice.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from arabic_text import search_text
+from chat_archive import load_archived, load_archived_for_chats, merge_archived
+
+logger = logging.getLogger(__name__)
+
+# Fields returned to the API for each message
+MESSAGE_PROJECTION = {"_id": 0, "chat_id": 0, "search_text": 0, "stored_at": 0, "job_id": 0}
+
+PREVIEW_LENGTH = 80
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def message_preview(content: str) -> str:
+    """Short single-line preview of a message used by chat summaries"""
+    preview = " ".join(content.split())
+    return preview[:PREVIEW_LENGTH] + "..." if len(preview) > PREVIEW_LENGTH else preview
+
+
+def message_doc(chat_id: str, seq: int, message: dict) -> dict:
+    """Build the stored document for a message"""
+    doc = dict(message)
+    doc['_id'] = doc['id']
+    doc['chat_id'] = chat_id
+    doc['seq'] = seq
+    doc['search_text'] = search_text(doc['content'])
+    # Write time, used by delta sync (``timestamp`` is when the message was created)
+    doc['stored_at'] = datetime.utcnow()
+    return doc
+
+
+async def _insert_ignoring_duplicates(db, docs: List[dict]):
+    """Insert message documents, skipping ones that already exist"""
+    if not docs:
+        return
+    try:
+        await db.messages.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(err.get('code') != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+
+
+async def migrate_chat(db, chat: dict) -> dict:
+    """Move the embedded ``messages`` array of a legacy chat into the messages collection.
+
+    Safe to run concurrently and repeatedly: message documents reuse the message
+    id as ``_id`` and the array is only unset once all messages are stored.
+    """
+    if 'messages' not in chat:
+        return chat
+
+    messages = chat.get('messages') or []
+    docs = [message_doc(chat['id'], seq, message) for seq, message in enumerate(messages)]
+    await _insert_ignoring_duplicates(db, docs)
+
+    update = {
+        "$set": {"message_count": len(messages)},
+        "$unset": {"messages": ""},
+        "$inc": {"version": 1},
+    }
+    if messages:
+        update["$set"]["last_message"] = message_preview(messages[-1]['content'])
+    await db.chats.update_one({"id": chat['id'], "messages": {"$exists": True}}, update)
+
+    chat = {k: v for k, v in chat.items() if k != 'messages'}
+    chat.update(update["$set"])
+    chat['version'] = chat.get('version', 0) + 1
+    return chat
+
+
+async def migrate_embedded_chats(db, batch_size: int = 100) -> int:
+    """Migrate every chat that still embeds its messages, returning how many were moved"""
+    migrated = 0
+    cursor = db.chats.find({"messages": {"$exists": True}}).batch_size(batch_size)
+    async for chat in cursor:
+        await migrate_chat(db, chat)
+        migrated += 1
+    if migrated:
+        logger.info(f"Migrated {migrated} chats to the messages collection")
+    return migrated
+
+
+async def append_messages(db, chat_id: str, messages: List[dict]) -> Tuple[Optional[dict], int]:
+    """Append messages to a chat.
+
+    Reserves a contiguous range of sequence numbers with a single atomic
+    ``$inc`` on the chat document, then inserts the messages. Returns the
+    updated chat document (``None`` if the chat does not exist) and the
+    sequence number of the first appended message.
+    """
+    chat = await db.chats.find_one_and_update(
+        {"id": chat_id},
+        {
+            "$inc": {"message_count": len(messages), "version": 1},
+            "$set": {
+                "updated_at": datetime.utcnow(),
+                "last_message": message_preview(messages[-1]['content']),
+            },
+        },
+        projection={"messages": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not chat:
+        return None, 0
+
+    first_seq = chat['message_count'] - len(messages)
+    docs = [message_doc(chat_id, first_seq + i, message) for i, message in enumerate(messages)]
+    await db.messages.insert_many(docs)
+    return chat, first_seq
+
+
+async def load_messages(
+    db,
+    chat: dict,
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+) -> List[dict]:
+    """Load the messages of a chat document in order.
+
+    With ``limit`` only the last ``limit`` messages are returned, and with
+    ``before`` only messages whose ``seq`` is lower than it, so older history
+    can be fetched page by page.
+    """
+    chat_id = chat['id']
+    query = {"chat_id": chat_id}
+    if before is not None:
+        query["seq"] = {"$lt": before}
+
+    if limit is None:
+        cursor = db.messages.find(query, MESSAGE_PROJECTION).sort("seq", 1)
+        messages = await cursor.to_list(None)
+    else:
+        # Read the newest messages first so the query stops after ``limit`` documents
+        cursor = db.messages.find(query, MESSAGE_PROJECTION).sort("seq", -1).limit(limit)
+        messages = await cursor.to_list(limit)
+        messages.reverse()
+
+    if _reaches_archive(chat, messages, limit, before):
+        messages = merge_archived(await load_archived(db, chat_id), messages, limit, before)
+    return messages
+
+
+def _reaches_archive(chat: dict, messages: List[dict], limit: Optional[int], before: Optional[int]) -> bool:
+    """Whether the page needs messages older than the hot ones loaded from the archive.
+
+    The archive holds the messages from ``trimmed_upto`` up to ``archived_upto``
+    of the chat document, so chats without an archive, or whose page starts
+    past it, never read it.
+    """
+    if limit is not None and len(messages) >= limit:
+        return False
+    trimmed_upto = chat.get('trimmed_upto', 0)
+    if chat.get('archived_upto', 0) <= trimmed_upto:
+        return False
+    oldest = messages[0]['seq'] if messages else before
+    if before is not None and oldest is not None:
+        oldest = min(oldest, before)
+    return oldest is None or oldest > trimmed_upto
+
+
+async def load_messages_for_chats(db, chats: List[dict]) -> Dict[str, List[dict]]:
+    """Load the messages of several chat documents with a single query"""
+    grouped = {chat['id']: [] for chat in chats}
+    if not chats:
+        return grouped
+    cursor = db.messages.find(
+        {"chat_id": {"$in": list(grouped)}},
+        {"_id": 0, "search_text": 0, "stored_at": 0, "job_id": 0},
+    ).sort([("chat_id", 1), ("seq", 1)])
+    async for message in cursor:
+        grouped[message.pop('chat_id')].append(message)
+
+    archived_ids = [chat['id'] for chat in chats if _reaches_archive(chat, grouped[chat['id']], None, None)]
+    if archived_ids:
+        archives = await load_archived_for_chats(db, archived_ids)
+        for chat_id, archived in archives.items():
+            grouped[chat_id] = merge_archived(archived, grouped[chat_id], None, None)
+    return grouped
+
@@ -0,0 +1,320 @@
+"""Lightweight Prometheus metrics.
+
+A small dependency-free implementation of counters, gauges and histograms with
+the text exposition format served on ``/api/metrics``. Updates are a dict lookup
+and a few additions under a lock (Mongo command events arrive from driver
+threads), cheap enough to leave on in production.
+
+Also provides:
+
+- ``MetricsMiddleware``: per-route latency histograms and in-flight gauges,
+  plus an optional ``Server-Timing`` header on every response
+- ``MongoCommandMetrics``: a pymongo command listener timing every Mongo command
+- ``LlmCallTimer``: latency, time to first token and outcome of LLM calls
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        # Callbacks refreshing gauges from other components at scrape time
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+# Time spent per component (e.g. "llm") during the current request
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def add_request_timing(name: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and in-flight requests per route"""
+
+    def __init__(self, app, duration: Histogram, in_flight: Gauge, timing_header: bool = False):
+        self.app = app
+        self.duration = duration
+        self.in_flight = in_flight
+        self.timing_header = timing_header
+        self._route_paths: Dict[Callable, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[endpoint] = path = path or "unmatched"
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+        method = scope["method"]
+        timings = {}
+        request_timings.set(timings)
+        self.in_flight.inc(method)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.timing_header:
+                    entries = [("app", time.perf_counter() - start), *timings.items()]
+                    value = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.in_flight.dec(method)
+            self.duration.observe(method, self._route_label(scope), status[0], value=time.perf_counter() - start)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Time every Mongo command by command name and collection"""
+
+    def __init__(self, duration: Histogram, failures: Counter):
+        self.duration = duration
+        self.failures = failures
+        self._collections: Dict[Tuple, str] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[self._key(event)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop(self._key(event), "")
+        self.duration.observe(event.command_name, collection, value=event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop(self._key(event), "")
+        self.duration.observe(event.command_name, collection, value=event.duration_micros / 1e6)
+        self.failures.inc(event.command_name, collection)
+
+
+class LlmCallTimer:
+    """Context manager recording one LLM call"""
+
+    def __init__(self, chat_type: str, provider: str, model: str):
+        self.labels = (chat_type, provider, model)
+        self.provider = provider
+        self._first_token = False
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        llm_requests_in_flight.inc(self.provider)
+        return self
+
+    def first_token(self):
+        if not self._first_token:
+            self._first_token = True
+            llm_time_to_first_token.observe(*self.labels, value=time.perf_counter() - self.start)
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        llm_requests_in_flight.dec(self.provider)
+        llm_request_duration.observe(*self.labels, value=elapsed)
+        if exc_type is None:
+            outcome = "success"
+        elif issubclass(exc_type, asyncio.CancelledError):
+            # e.g. the slower attempt of a hedged call
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        llm_requests.inc(*self.labels, outcome)
+        add_request_timing("llm", elapsed)
+        return False
+
+
+# Shared registry and the metrics recorded by the server
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"),
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",),
+)
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+mongo_command_failures = registry.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("command", "collection"),
+)
+llm_request_duration = registry.histogram(
+    "llm_request_duration_seconds", "LLM call latency", ("chat_type", "provider", "model"),
+)
+llm_time_to_first_token = registry.histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed token", ("chat_type", "provider", "model"),
+)
+llm_requests = registry.counter(
+    "llm_requests_total", "LLM calls by outcome", ("chat_type", "provider", "model", "outcome"),
+)
+llm_requests_in_flight = registry.gauge(
+    "llm_requests_in_flight", "LLM calls currently running", ("provider",),
+)
+llm_failovers = registry.counter(
+    "llm_failovers_total", "LLM attempts that failed over to the next provider", ("chat_type", "provider", "reason"),
+)
+llm_hedges = registry.counter(
+    "llm_hedges_total", "Hedged LLM calls by whether the hedge answered first", ("chat_type", "outcome"),
+)
+llm_queue_wait = registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a provider slot", ("provider",),
+)
+llm_admission_rejections = registry.counter(
+    "llm_admission_rejections_total", "LLM calls turned away by admission control", ("provider", "reason"),
+)
+llm_admission = registry.gauge(
+    "llm_admission", "Provider slots and wait queue of admission control", ("provider", "stat"),
+)
+
+
+def stats_collector(gauge: Gauge, stats: Callable[[], Optional[dict]], labels: Iterable = ()):
+    """Collector copying the numeric values of a ``stats()`` dict into ``gauge``"""
+    labels = tuple(labels)
+
+    def collect():
+        values = stats() or {}
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauge.set(*labels, key, value=value)
+
+    return collect
@@ -0,0 +1,45 @@
+"""Keyset pagination helpers for chat listings.
+
+Chats are ordered by ``(updated_at, id)`` descending. A cursor encodes the sort
+key of the last chat on a page, and the next page is everything strictly after
+it in that order, so paging never skips or repeats chats and never uses ``skip``.
+"""
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+CHAT_SORT = [("updated_at", -1), ("id", -1)]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(updated_at: datetime, chat_id: str) -> str:
+    """Encode the sort key of a chat as an opaque cursor"""
+    raw = f"{updated_at.isoformat()}|{chat_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by ``encode_cursor``"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        updated_at, chat_id = raw.split("|", 1)
+        return datetime.fromisoformat(updated_at), chat_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def chats_after(cursor: Optional[str]) -> dict:
+    """Mongo filter selecting the chats that come after ``cursor``"""
+    if not cursor:
+        return {}
+    updated_at, chat_id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "id": {"$lt": chat_id}},
+        ]
+    }
@@ -0,0 +1,232 @@
+"""Retention: deleting idle chats and capping the history of long ones.
+
+Collections whose documents expire on their own (sync tombstones, message
+jobs, the Mongo answer cache) use TTL indexes. Chats cannot: deleting a chat
+must also delete its messages and archive and leave a tombstone, so chats are
+deleted by this module instead, in batches of unordered ``bulk_write``
+operations with a pause between batches. A batch holds at most ``batch_size``
+messages, which bounds the work a single batch puts on the database next to
+serving traffic: a chat with more messages is deleted on its own, its messages
+in ``seq`` ranges of ``batch_size`` first, then the chat document.
+
+The per-chat cap drops the oldest messages of chats longer than
+``max_messages``, from the hot collection and the archive, and records the
+first kept ``seq`` in ``trimmed_upto``, also at most ``batch_size`` messages
+per batch: a chat with more to drop is trimmed over several batches. The chat
+``version`` is bumped, so cached copies and ETags change; delta sync does not
+report trimmed messages.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+from chat_archive import trim_archive
+from sync import record_tombstones
+
+logger = logging.getLogger(__name__)
+
+
+def idle_query(idle_days: float) -> dict:
+    """Chats without writes for ``idle_days`` days"""
+    return {"updated_at": {"$lt": datetime.utcnow() - timedelta(days=idle_days)}}
+
+
+class RetentionEngine:
+    def __init__(
+        self,
+        db,
+        tombstone_ttl: timedelta,
+        idle_days: float = 0,
+        max_messages: int = 0,
+        batch_size: int = 500,
+        pause: float = 0.1,
+        forget: Optional[Callable[[List[str]], None]] = None,
+        invalidate: Optional[Callable[[List[str]], None]] = None,
+    ):
+        self.db = db
+        self.tombstone_ttl = tombstone_ttl
+        self.idle_days = idle_days
+        self.max_messages = max_messages
+        self.batch_size = batch_size
+        self.pause = pause
+        self.forget = forget
+        self.invalidate = invalidate
+        self.runs = 0
+        self.chats_deleted = 0
+        self.messages_deleted = 0
+        self.messages_trimmed = 0
+        self.last_run_seconds = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.idle_days or self.max_messages)
+
+    async def count(self, query: dict) -> Dict[str, int]:
+        """How many chats and messages ``delete_chats(query)`` would delete"""
+        totals = await self.db.chats.aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": None,
+                "chats": {"$sum": 1},
+                "messages": {"$sum": {"$subtract": [
+                    {"$ifNull": ["$message_count", 0]},
+                    {"$ifNull": ["$trimmed_upto", 0]},
+                ]}},
+            }},
+        ]).to_list(1)
+        if not totals:
+            return {"chats": 0, "messages": 0}
+        return {"chats": totals[0]['chats'], "messages": totals[0]['messages']}
+
+    def _batches(self, chats: List[dict]):
+        """Split chats into batches of at most ``batch_size`` messages, larger chats alone"""
+        batch, messages = [], 0
+        for chat in chats:
+            size = chat.get('message_count', 0) - chat.get('trimmed_upto', 0)
+            if batch and messages + size > self.batch_size:
+                yield batch
+                batch, messages = [], 0
+            batch.append(chat)
+            messages += size
+        if batch:
+            yield batch
+
+    async def _delete_messages_in_ranges(self, chat: dict) -> int:
+        """Delete the messages of a chat ``batch_size`` seqs at a time, pausing in between"""
+        deleted = 0
+        start = chat.get('trimmed_upto', 0)
+        while start < chat.get('message_count', 0):
+            result = await self.db.messages.delete_many(
+                {"chat_id": chat['id'], "seq": {"$gte": start, "$lt": start + self.batch_size}},
+            )
+            deleted += result.deleted_count
+            start += self.batch_size
+            await asyncio.sleep(self.pause)
+        return deleted
+
+    async def _delete_batch(self, chat_ids: List[str]) -> Dict[str, int]:
+        chats = await self.db.chats.bulk_write([DeleteOne({"id": chat_id}) for chat_id in chat_ids], ordered=False)
+        messages = await self.db.messages.bulk_write(
+            [DeleteMany({"chat_id": chat_id}) for chat_id in chat_ids], ordered=False,
+        )
+        await self.db.chat_archives.bulk_write([DeleteOne({"_id": chat_id}) for chat_id in chat_ids], ordered=False)
+        if chats.deleted_count:
+            await record_tombstones(self.db, chat_ids, self.tombstone_ttl)
+        if self.forget:
+            self.forget(chat_ids)
+        self.chats_deleted += chats.deleted_count
+        self.messages_deleted += messages.deleted_count
+        return {"chats": chats.deleted_count, "messages": messages.deleted_count}
+
+    async def delete_chats(self, query: dict) -> Dict[str, int]:
+        """Delete the chats matching ``query`` with their messages, batch by batch"""
+        deleted = {"chats": 0, "messages": 0}
+        first = True
+        while True:
+            # Deleted chats no longer match, so every round starts over
+            chats = await self.db.chats.find(
+                query, {"_id": 0, "id": 1, "message_count": 1, "trimmed_upto": 1},
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not chats:
+                return deleted
+            round_deleted = 0
+            for batch in self._batches(chats):
+                if not first:
+                    await asyncio.sleep(self.pause)
+                first = False
+                ranged = 0
+                if len(batch) == 1:
+                    size = batch[0].get('message_count', 0) - batch[0].get('trimmed_upto', 0)
+                    if size > self.batch_size:
+                        # The chat goes last, so an interrupted delete is resumed by the next run
+                        ranged = await self._delete_messages_in_ranges(batch[0])
+                        self.messages_deleted += ranged
+                counts = await self._delete_batch([chat['id'] for chat in batch])
+                round_deleted += counts["chats"]
+                deleted["chats"] += counts["chats"]
+                deleted["messages"] += counts["messages"] + ranged
+            if not round_deleted:
+                # Deleted concurrently: stop rather than loop
+                return deleted
+
+    def _trim_cutoffs(self, chats: List[dict]) -> Dict[str, int]:
+        """The new ``trimmed_upto`` of chats, dropping at most ``batch_size`` messages in all"""
+        cutoffs, budget = {}, self.batch_size
+        for chat in chats:
+            start = chat.get('trimmed_upto', 0)
+            cutoff = min(chat['message_count'] - self.max_messages, start + budget)
+            cutoffs[chat['id']] = cutoff
+            budget -= cutoff - start
+            if budget <= 0:
+                break
+        return cutoffs
+
+    async def trim_chats(self) -> int:
+        """Drop the oldest messages of chats longer than ``max_messages``, returning how many"""
+        cap = self.max_messages
+        query = {
+            "message_count": {"$gt": cap},
+            "$expr": {"$lt": [{"$ifNull": ["$trimmed_upto", 0]}, {"$subtract": ["$message_count", cap]}]},
+        }
+        trimmed = 0
+        while True:
+            chats = await self.db.chats.find(
+                query, {"_id": 0, "id": 1, "message_count": 1, "archived_upto": 1, "trimmed_upto": 1},
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not chats:
+                return trimmed
+            cutoffs = self._trim_cutoffs(chats)
+            result = await self.db.messages.bulk_write([
+                DeleteMany({"chat_id": chat_id, "seq": {"$lt": cutoff}})
+                for chat_id, cutoff in cutoffs.items()
+            ], ordered=False)
+            batch_trimmed = result.deleted_count
+            for chat in chats:
+                if chat['id'] in cutoffs and chat.get('archived_upto'):
+                    batch_trimmed += await trim_archive(self.db, chat['id'], cutoffs[chat['id']])
+            await self.db.chats.bulk_write([
+                UpdateOne({"id": chat_id}, {"$max": {"trimmed_upto": cutoff}, "$inc": {"version": 1}})
+                for chat_id, cutoff in cutoffs.items()
+            ], ordered=False)
+            if self.invalidate:
+                self.invalidate(list(cutoffs))
+            trimmed += batch_trimmed
+            self.messages_trimmed += batch_trimmed
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self):
+        started = time.perf_counter()
+        if self.idle_days:
+            deleted = await self.delete_chats(idle_query(self.idle_days))
+            if deleted["chats"]:
+                logger.info(f"Retention deleted {deleted['chats']} idle chats and {deleted['messages']} messages")
+        if self.max_messages:
+            trimmed = await self.trim_chats()
+            if trimmed:
+                logger.info(f"Retention trimmed {trimmed} messages from long chats")
+        self.runs += 1
+        self.last_run_seconds = time.perf_counter() - started
+
+    async def run(self, interval: float):
+        """Apply the retention policy every ``interval`` seconds"""
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Retention failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "idle_days": self.idle_days,
+            "max_messages": self.max_messages,
+            "runs": self.runs,
+            "chats_deleted": self.chats_deleted,
+            "messages_deleted": self.messages_deleted,
+            "messages_trimmed": self.messages_trimmed,
+            "last_run_seconds": self.last_run_seconds,
+        }
@@ -0,0 +1,221 @@
+"""Full-text search over chat titles and messages.
+
+Messages and chats store a ``search_text`` / ``search_title`` field holding
+their normalized, article-stripped words (see ``arabic_text.search_text``),
+covered by Mongo text indexes created with ``default_language: none`` so no
+English stemming or stop words are applied to Arabic. A query is normalized
+the same way and answered from the indexes: the best-scoring messages are
+grouped by chat, combined with title matches and ranked, and only the page
+being returned is read in full to build highlighted snippets.
+
+Archived chat histories (see ``chat_archive``) are searched through the words
+of the whole archive, stored on the archive document under its own text index.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from arabic_text import WORD, normalize_arabic, search_stem, search_text, search_tokens
+from chat_archive import load_archived
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_LENGTH = 120
+
+# A title match weighs more than a match in one message
+TITLE_WEIGHT = 2.0
+
+
+def _normalized_offsets(text: str) -> Tuple[str, List[int]]:
+    """Normalize ``text`` keeping, for each normalized character, its index in ``text``"""
+    chars = []
+    offsets = []
+    for index, char in enumerate(text):
+        for normalized in normalize_arabic(char):
+            chars.append(normalized)
+            offsets.append(index)
+    return "".join(chars), offsets
+
+
+def highlight(text: str, terms: List[str], length: int = SNIPPET_LENGTH) -> Tuple[str, List[List[int]]]:
+    """Cut a snippet of ``text`` around the first matching word.
+
+    Returns the snippet and the ``[start, end)`` offsets of the matching words
+    in it.
+    """
+    normalized, offsets = _normalized_offsets(text)
+    spans = [
+        (offsets[match.start()], offsets[match.end() - 1] + 1)
+        for match in WORD.finditer(normalized)
+        if search_stem(match.group()) in terms
+    ]
+
+    start = 0
+    if spans and len(text) > length:
+        start = max(0, min(spans[0][0] - length // 4, len(text) - length))
+    end = min(len(text), start + length)
+
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    snippet = prefix + text[start:end] + suffix
+    highlights = [
+        [span_start - start + len(prefix), min(span_end, end) - start + len(prefix)]
+        for span_start, span_end in spans
+        if span_start >= start and span_start < end
+    ]
+    return snippet, highlights
+
+
+def best_archived_match(messages: List[dict], terms: List[str]) -> Optional[dict]:
+    """The archived message matching the most query words"""
+    wanted = set(terms)
+    best, best_count = None, 0
+    for message in messages:
+        count = len(wanted.intersection(search_tokens(message['content'])))
+        if count > best_count:
+            best, best_count = message, count
+    return best
+
+
+def rank_matches(
+    title_matches: List[dict], message_matches: List[dict], archive_matches: List[dict],
+) -> Tuple[Dict[str, dict], List[str]]:
+    """Combine title, message and archive matches per chat.
+
+    Returns the combined hit of each chat and the chat ids, best first: by
+    score, then by number of matching messages, then by id.
+    """
+    ranked: Dict[str, dict] = {}
+    for match in title_matches:
+        ranked[match['id']] = {"score": match['score'] * TITLE_WEIGHT, "matches": 0, "message_id": None}
+    for match in message_matches:
+        hit = ranked.setdefault(match['_id'], {"score": 0.0, "matches": 0, "message_id": None})
+        hit["score"] += match['score']
+        hit["matches"] = match['matches']
+        hit["message_id"] = match['message_id']
+    for match in archive_matches:
+        hit = ranked.setdefault(match['_id'], {"score": 0.0, "matches": 0, "message_id": None})
+        hit["score"] += match['score']
+        hit["archived"] = True
+
+    order = sorted(ranked, key=lambda chat_id: (-ranked[chat_id]["score"], -ranked[chat_id]["matches"], chat_id))
+    return ranked, order
+
+
+async def search_chats(
+    db,
+    query: str,
+    limit: int = 20,
+    offset: int = 0,
+    max_candidates: int = 1000,
+) -> Tuple[List[dict], Optional[int]]:
+    """Rank chats matching ``query`` by their title and best matching message.
+
+    Returns one page of hits and the offset of the next page (``None`` on the
+    last page). Only the ``max_candidates`` best scoring messages are grouped,
+    ranked and transferred; Mongo still scores every message matching the
+    query to find them, so a query made of very common words costs time in
+    proportion to its matches.
+    """
+    terms = list(dict.fromkeys(search_tokens(query)))
+    if not terms:
+        return [], None
+    text_query = {"$text": {"$search": " ".join(terms)}}
+
+    title_matches = await db.chats.find(
+        text_query,
+        {"_id": 0, "id": 1, "score": {"$meta": "textScore"}},
+    ).sort([("score", {"$meta": "textScore"})]).to_list(max_candidates)
+
+    message_matches = await db.messages.aggregate([
+        {"$match": text_query},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$sort": {"score": -1}},
+        {"$limit": max_candidates},
+        # Sorted by score, so $first is the best message of each chat
+        {"$group": {
+            "_id": "$chat_id",
+            "score": {"$first": "$score"},
+            "matches": {"$sum": 1},
+            "message_id": {"$first": "$id"},
+        }},
+    ]).to_list(None)
+
+    archive_matches = await db.chat_archives.find(
+        text_query,
+        {"_id": 1, "score": {"$meta": "textScore"}},
+    ).sort([("score", {"$meta": "textScore"})]).to_list(max_candidates)
+
+    ranked, order = rank_matches(title_matches, message_matches, archive_matches)
+    page = order[offset:offset + limit]
+    next_offset = offset + limit if len(order) > offset + limit else None
+    if not page:
+        return [], next_offset
+
+    chats = {
+        chat['id']: chat
+        for chat in await db.chats.find(
+            {"id": {"$in": page}},
+            {"_id": 0, "id": 1, "title": 1, "updated_at": 1},
+        ).to_list(None)
+    }
+    message_ids = [ranked[chat_id]["message_id"] for chat_id in page if ranked[chat_id]["message_id"]]
+    messages = {
+        message['id']: message
+        for message in await db.messages.find(
+            {"_id": {"$in": message_ids}},
+            {"_id": 0, "id": 1, "seq": 1, "content": 1},
+        ).to_list(None)
+    }
+
+    for chat_id in page:
+        if ranked[chat_id].get("archived") and not ranked[chat_id]["message_id"]:
+            message = best_archived_match(await load_archived(db, chat_id), terms)
+            if message:
+                ranked[chat_id]["message_id"] = message['id']
+                messages[message['id']] = message
+
+    hits = []
+    for chat_id in page:
+        chat = chats.get(chat_id)
+        if chat is None:
+            # Deleted since the index was read
+            continue
+        message = messages.get(ranked[chat_id]["message_id"])
+        snippet, highlights = highlight(message['content'] if message else chat['title'], terms)
+        hits.append({
+            "chat_id": chat_id,
+            "title": chat['title'],
+            "updated_at": chat.get('updated_at'),
+            "score": ranked[chat_id]["score"],
+            "matches": ranked[chat_id]["matches"],
+            "message_id": message['id'] if message else None,
+            "seq": message['seq'] if message else None,
+            "snippet": snippet,
+            "highlights": highlights,
+        })
+    return hits, next_offset
+
+
+async def backfill_search_fields(db, batch_size: int = 500) -> int:
+    """Add the search fields to chats and messages stored before search existed"""
+    updated = 0
+    for collection, source, target in (("chats", "title", "search_title"), ("messages", "content", "search_text")):
+        operations = []
+        cursor = db[collection].find(
+            {target: {"$exists": False}},
+            {"_id": 1, source: 1},
+        ).batch_size(batch_size)
+        async for doc in cursor:
+            operations.append(UpdateOne({"_id": doc['_id']}, {"$set": {target: search_text(doc.get(source) or "")}}))
+            if len(operations) >= batch_size:
+                await db[collection].bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+        if operations:
+            await db[collection].bulk_write(operations, ordered=False)
+            updated += len(operations)
+    if updated:
+        logger.info(f"Added search fields to {updated} documents")
+    return updated
@@ -0,0 +1,77 @@
+"""Response bodies built straight from stored documents.
+
+Documents read from Mongo were validated when they were written, so the chat
+endpoints do not rebuild pydantic models from them (and have FastAPI validate
+them a second time through ``response_model``). Instead the documents are mapped
+to plain dicts in the exact shape of the response models and encoded with
+orjson when it is installed, falling back to the standard library.
+"""
+import json
+from datetime import datetime
+from typing import Any, List
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode ``content`` as compact UTF-8 JSON, datetimes in ISO format"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=_default,
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def message_payload(message: dict) -> dict:
+    """A stored message in the ``Message`` schema"""
+    return {
+        "id": message['id'],
+        "role": message['role'],
+        "content": message['content'],
+        "timestamp": message['timestamp'],
+        "seq": message.get('seq'),
+    }
+
+
+def chat_payload(chat: dict, messages: List[dict]) -> dict:
+    """A stored chat and its messages in the ``Chat`` schema"""
+    return {
+        "id": chat['id'],
+        "title": chat['title'],
+        "messages": [message_payload(message) for message in messages],
+        "message_count": chat.get('message_count', 0),
+        "trimmed_upto": chat.get('trimmed_upto', 0),
+        "created_at": chat['created_at'],
+        "updated_at": chat['updated_at'],
+    }
+
+
+def chat_summary_payload(chat: dict) -> dict:
+    """A stored chat in the ``ChatSummary`` schema"""
+    return {
+        "id": chat['id'],
+        "title": chat['title'],
+        "updated_at": chat['updated_at'],
+        "message_count": chat.get('message_count', 0),
+        "last_message": chat.get('last_message'),
+    }
@@ -1,26 +1,153 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+# Imported first so that it can time the imports below
+from startup_profile import profile as startup_profile
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from pymongo import ReturnDocument
+from typing import List, Optional, Union
 import uuid
-from datetime import datetime
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+from datetime import datetime, timedelta
+from answer_cache import create_answer_cache
+from chat_archive import ChatArchiver
+from chat_cache import ChatCache
+from arabic_text import search_text
+from chat_export import export_ndjson, gzip_chunks, import_ndjson
+from chat_turns import ChatTurnQueue, TurnQueueFull
+from context_builder import ContextBuilder
+from database import LazyDatabase, create_mongo_client, ping, prepare_database
+import metrics
+from intent_router import IntentRouter
+from llm_admission import AdmissionController
+from llm_failover import LlmRouter, LlmTarget, LlmUnavailable, RoutePolicy, load_policies
+from llm_providers import LlmBackend, start_turn, stream_reply
+from llm_registry import LlmClientRegistry
+from message_jobs import JobFailed, JobQueueFull, MessageJobs, job_payload
+from message_store import (
+    append_messages,
+    load_messages,
+    load_messages_for_chats,
+    migrate_chat,
+    migrate_embedded_chats,
+)
+from retention import RetentionEngine, idle_query
+from pagination import CHAT_SORT, InvalidCursor, chats_after, encode_cursor
+from search import backfill_search_fields, search_chats
+from serialization import FastJSONResponse, chat_payload, chat_summary_payload, dumps
+from sync import SyncTokenExpired, body_etag, chat_etag, etag_matches, load_changes
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# LLM client classes (emergentintegrations, or the offline fake provider), imported on first use
+llm = LlmBackend()
+
+# MongoDB connection, opened on first use
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+def connect_mongo():
+    with startup_profile.step("mongo client"):
+        return create_mongo_client(
+            mongo_url,
+            event_listeners=[metrics.MongoCommandMetrics(
+                metrics.mongo_command_duration,
+                metrics.mongo_command_failures,
+            )] if METRICS_ENABLED else [],
+        )
+
+db = LazyDatabase(connect_mongo, os.environ['DB_NAME'])
+
+# Recently active chat documents, invalidated by version checks or a change stream
+chat_cache = ChatCache(
+    db,
+    max_bytes=int(os.environ.get('CHAT_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    invalidation=os.environ.get('CHAT_CACHE_INVALIDATION', 'auto'),
+    validity=float(os.environ.get('CHAT_CACHE_VALIDITY', '1')),
+)
+
+# Message history of chats idle this many days is compressed into chat_archives (0 disables)
+CHAT_ARCHIVE_IDLE_DAYS = float(os.environ.get('CHAT_ARCHIVE_IDLE_DAYS', '0'))
+chat_archiver = ChatArchiver(
+    db,
+    idle_days=CHAT_ARCHIVE_IDLE_DAYS,
+    codec=os.environ.get('CHAT_ARCHIVE_CODEC', 'gzip'),
+) if CHAT_ARCHIVE_IDLE_DAYS else None
+
+async def warm_up():
+    """Import the LLM provider off the event loop, so the first message does not pay for it"""
+    try:
+        with startup_profile.step("llm provider"):
+            await asyncio.to_thread(llm.load)
+    except Exception as e:
+        # Loaded again, and reported, by the first message
+        logger.error(f"Error loading the LLM provider: {str(e)}")
+
+async def run_startup_step(name: str, step):
+    """Run a one-shot startup step, logging its failure instead of stopping the others"""
+    try:
+        await step()
+    except Exception as e:
+        logger.error(f"Startup step {name} failed: {str(e)}")
+
+def start_maintenance() -> List[asyncio.Task]:
+    """Start the background maintenance loops, each in its own task"""
+    tasks = []
+    if chat_archiver:
+        interval = float(os.environ.get('CHAT_ARCHIVE_INTERVAL', '3600'))
+        tasks.append(asyncio.create_task(chat_archiver.run(interval=interval)))
+    if retention.enabled:
+        interval = float(os.environ.get('RETENTION_INTERVAL', '3600'))
+        tasks.append(asyncio.create_task(retention.run(interval=interval)))
+    return tasks
+
+async def prepare_app(app: FastAPI):
+    """Verify the database and create indexes, then mark the app ready"""
+    warm_up_task = asyncio.create_task(warm_up())
+    with startup_profile.step("database"):
+        await prepare_database(db)
+        if answer_cache:
+            await answer_cache.ensure_indexes()
+    app.state.ready = True
+    logger.info("Database ready")
+    await warm_up_task
+    startup_profile.finish()
+    
+    # Existing chats are also migrated lazily on access, so this is not needed to be ready
+    await run_startup_step("migrate_embedded_chats", lambda: migrate_embedded_chats(db))
+    await run_startup_step("backfill_search_fields", lambda: backfill_search_fields(db))
+    await run_startup_step("recover_message_jobs", lambda: message_jobs.recover(startup=True))
+    app.state.maintenance_tasks = start_maintenance()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve (and report not ready) while the database is being prepared
+    app.state.ready = False
+    app.state.maintenance_tasks = []
+    app.state.prepare_task = asyncio.create_task(prepare_app(app))
+    chat_cache.start()
+    message_jobs.start()
+    yield
+    # Stop the background work before the database client it uses
+    background = [app.state.prepare_task, *app.state.maintenance_tasks]
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await message_jobs.stop()
+    await context_builder.stop()
+    await chat_cache.stop()
+    db.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -31,34 +158,60 @@ class Message(BaseModel):
     role: str  # 'user' or 'assistant'
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    seq: Optional[int] = None  # position in the chat, set once stored
 
 class Chat(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
     messages: List[Message] = []
+    message_count: int = 0
+    trimmed_upto: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ChatSummary(BaseModel):
+    id: str
+    title: str
+    updated_at: datetime
+    message_count: int = 0
+    last_message: Optional[str] = None
+
+class ChatListResponse(BaseModel):
+    chats: List[ChatSummary]
+    next_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    chat_id: str
+    title: str
+    updated_at: Optional[datetime] = None
+    score: float
+    matches: int = 0  # matching messages among the candidates
+    message_id: Optional[str] = None  # best matching message, if any
+    seq: Optional[int] = None
+    snippet: str
+    highlights: List[List[int]] = []  # [start, end) of matched words in the snippet
+
+class SearchResponse(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
 class ChatCreate(BaseModel):
     title: str = "محادثة جديدة"
 
 class MessageCreate(BaseModel):
     content: str
     chat_id: str
+    client_message_id: Optional[str] = None  # lets retries of the same message be recognized
 
 class ChatResponse(BaseModel):
     success: bool
     chat: Optional[Chat] = None
     message: Optional[str] = None
 
-# Initialize AI Chat instances for different purposes
-def get_ai_chat(chat_type: str = "general", session_id: str = None):
-    """Get AI chat instance based on type and session"""
-    emergent_key = os.environ.get('EMERGENT_LLM_KEY')
-    
-    if chat_type == "educational":
-        # Use Claude for educational content
-        system_message = """أنت فيصل، مساعد تعليمي ذكي مخصص للطلاب الناطقين بالعربية. 
+EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
+
+# System prompts for the different AI routes
+EDUCATIONAL_SYSTEM_MESSAGE = """أنت فيصل، مساعد تعليمي ذكي مخصص للطلاب الناطقين بالعربية. 
         مهمتك هي:
         1. تقديم شروحات واضحة ومبسطة للمفاهيم الدراسية
         2. مساعدة الطلاب في حل واجباتهم خطوة بخطوة دون حل كامل
@@ -67,88 +220,428 @@ def get_ai_chat(chat_type: str = "general", session_id: str = None):
         5. التفاعل بطريقة ودودة ومشجعة
         
         استخدم اللغة العربية في جميع ردودك وكن صبوراً ومساعداً."""
-        
-        chat = LlmChat(
-            api_key=emergent_key,
-            session_id=session_id or f"educational_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("anthropic", "claude-3-7-sonnet-20250219")
-        
-    elif chat_type == "creative":
-        # Use Gemini for creative tasks
-        system_message = """أنت فيصل، مساعد إبداعي للطلاب. 
+
+CREATIVE_SYSTEM_MESSAGE = """أنت فيصل، مساعد إبداعي للطلاب. 
         ساعد في المشاريع الإبداعية، الكتابة، والعصف الذهني.
         كن مبدعاً ومحفزاً للخيال والابتكار.
         استخدم اللغة العربية دائماً."""
-        
-        chat = LlmChat(
-            api_key=emergent_key,
-            session_id=session_id or f"creative_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-    else:
-        # Use GPT-4o-mini for general chat (default)
-        system_message = """أنت فيصل، مساعد ذكي للطلاب الناطقين بالعربية.
+
+GENERAL_SYSTEM_MESSAGE = """أنت فيصل، مساعد ذكي للطلاب الناطقين بالعربية.
         أنت مفيد، ودود، ومساعد في جميع الأسئلة الأكاديمية والحياتية.
         تتحدث العربية بطلاقة وتفهم ثقافة الطلاب العرب.
         كن مشجعاً ومحفزاً دائماً."""
-        
-        chat = LlmChat(
-            api_key=emergent_key,
-            session_id=session_id or f"general_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o-mini")
+
+# Provider, model and system prompt for each chat type
+AI_ROUTES = {
+    # Use Claude for educational content
+    "educational": ("anthropic", "claude-3-7-sonnet-20250219", EDUCATIONAL_SYSTEM_MESSAGE),
+    # Use Gemini for creative tasks
+    "creative": ("gemini", "gemini-2.0-flash", CREATIVE_SYSTEM_MESSAGE),
+    # Use GPT-4o-mini for general chat (default)
+    "general": ("openai", "gpt-4o-mini", GENERAL_SYSTEM_MESSAGE),
+}
+
+# Providers tried in order when the route's provider fails or misses its deadline
+AI_FALLBACKS = {
+    "educational": [("openai", "gpt-4o-mini")],
+    "creative": [("openai", "gpt-4o-mini")],
+    "general": [("gemini", "gemini-2.0-flash")],
+}
+
+def route_policies() -> dict:
+    """Fallback chain, attempt deadline and hedging of each route, with ``LLM_ROUTES`` overrides"""
+    attempt_timeout = float(os.environ.get('LLM_ATTEMPT_TIMEOUT', '45'))
+    hedge = os.environ.get('LLM_HEDGING', '0') == '1'
+    defaults = {
+        chat_type: RoutePolicy(
+            chain=[LlmTarget(provider, model)] + [LlmTarget(*target) for target in AI_FALLBACKS.get(chat_type, [])],
+            attempt_timeout=attempt_timeout,
+            hedge=hedge,
+        )
+        for chat_type, (provider, model, _) in AI_ROUTES.items()
+    }
+    overrides = os.environ.get('LLM_ROUTES')
+    return load_policies(defaults, json.loads(overrides) if overrides else None)
+
+# Concurrent calls per provider, with a bounded wait queue and queue-time budget
+llm_admission = AdmissionController(
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '32')),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', '64')),
+    queue_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT', '10')),
+    provider_limits=json.loads(os.environ.get('LLM_PROVIDER_LIMITS') or '{}'),
+)
+
+llm_router = LlmRouter(
+    route_policies(),
+    hedge_percentile=float(os.environ.get('LLM_HEDGE_PERCENTILE', '95')),
+    admission=llm_admission,
+)
+
+def build_ai_chat(chat_type: str, session_id: str, system_message: str = None, target: LlmTarget = None):
+    """Create a new AI chat client for a chat type, on its primary provider unless ``target`` is given"""
+    provider, model, route_system_message = AI_ROUTES.get(chat_type, AI_ROUTES["general"])
+    if target is not None:
+        provider, model = target.provider, target.model
+    system_message = system_message or route_system_message
+    return llm.LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model(provider, model)
+
+# AI chat clients are reused across the turns of a chat
+llm_clients = LlmClientRegistry(
+    build_ai_chat,
+    max_size=int(os.environ.get('LLM_CLIENT_CACHE_SIZE', '1000')),
+    idle_ttl=float(os.environ.get('LLM_CLIENT_IDLE_TTL', '1800')),
+)
+
+def get_ai_chat(chat_type: str = "general", session_id: str = None):
+    """Get AI chat instance based on type and session"""
+    if session_id is None:
+        return build_ai_chat(chat_type, f"{chat_type}_{uuid.uuid4()}")
+    return llm_clients.get(chat_type, session_id)
+
+SUMMARY_SYSTEM_MESSAGE = """أنت تلخص محادثة بين طالب ومساعده فيصل.
+        اكتب ملخصاً موجزاً باللغة العربية يحفظ أسئلة الطالب والمعلومات المهمة والنقاط التي تم شرحها.
+        لا تضف أي معلومات جديدة."""
+
+async def summarize_history(previous_summary: Optional[str], messages: List[dict]) -> str:
+    """Fold older messages into the rolling summary of a chat"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = f"الملخص السابق:\n{previous_summary}\n\n" if previous_summary else ""
+    prompt += f"رسائل جديدة:\n{transcript}\n\nاكتب الملخص المحدث."
     
-    return chat
+    def summary_chat(target: LlmTarget, primary: bool):
+        return build_ai_chat("general", f"summary_{uuid.uuid4()}", SUMMARY_SYSTEM_MESSAGE, target)
+    # Same deadline, admission and failover as answers, on the general route
+    # unless LLM_ROUTES has a "summary" route
+    return await llm_router.send("summary", summary_chat, llm.UserMessage(text=prompt))
+
+# Prompt history is assembled from stored messages under this budget;
+# 0 falls back to the in-memory history of the AI chat session
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '4000'))
+context_builder = ContextBuilder(
+    db,
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    summarize=summarize_history,
+    summary_tokens=int(os.environ.get('CONTEXT_SUMMARY_TOKENS', '500')),
+)
+
+async def ai_chats_for_turn(chat: dict, chat_type: str):
+    """Get the factory of AI chat clients answering the next turn of a chat, per route target"""
+    if not CONTEXT_TOKEN_BUDGET:
+        def session_chat(target: LlmTarget, primary: bool):
+            if primary:
+                return get_ai_chat(chat_type, chat['id'])
+            # Fallback providers do not share the session history of the primary client
+            return build_ai_chat(chat_type, f"{chat_type}_{chat['id']}_{uuid.uuid4()}", target=target)
+        return session_chat
+    
+    # The history comes from the database, not the session of the client
+    context = await context_builder.build(chat)
+    _, _, system_message = AI_ROUTES.get(chat_type, AI_ROUTES["general"])
+    system_message = context.render(system_message)
+    
+    def turn_chat(target: LlmTarget, primary: bool):
+        session_id = f"{chat_type}_{chat['id']}_{uuid.uuid4()}"
+        if primary:
+            # Keep the chat's client, on a session that holds only this turn's context
+            ai_chat = get_ai_chat(chat_type, chat['id'])
+            start_turn(ai_chat, session_id, system_message)
+            return ai_chat
+        return build_ai_chat(chat_type, session_id, system_message, target)
+    return turn_chat
+
+# Opt-in cache of first-turn answers ('memory' or 'mongo')
+answer_cache = create_answer_cache(
+    os.environ.get('ANSWER_CACHE', ''),
+    db,
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', '86400')),
+    max_entries=int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '10000')),
+)
 
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "فيصل - مساعد الطلاب الذكي"}
 
+@api_router.get("/health/live")
+async def health_live():
+    """Liveness probe: the process is serving requests"""
+    return {"status": "alive"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    """Readiness probe: indexes are in place and the database answers"""
+    if not getattr(app.state, 'ready', False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if not await ping(db):
+        return JSONResponse(status_code=503, content={"status": "database unavailable"})
+    return {"status": "ready"}
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        metrics.registry.expose(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@api_router.get("/stats")
+async def get_stats():
+    """Runtime counters for capacity planning"""
+    return {
+        "llm_clients": llm_clients.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "context": context_builder.stats(),
+        "chat_turns": chat_turns.stats(),
+        "llm_routes": llm_router.stats(),
+        "llm_admission": llm_admission.stats(),
+        "chat_archive": chat_archiver.stats() if chat_archiver else None,
+        "message_jobs": message_jobs.stats(),
+        "chat_cache": chat_cache.stats(),
+        "retention": retention.stats(),
+        "startup": startup_profile.stats(),
+    }
+
 @api_router.post("/chats", response_model=ChatResponse)
 async def create_chat(chat_data: ChatCreate):
     """Create a new chat"""
     try:
         new_chat = Chat(title=chat_data.title)
-        chat_dict = new_chat.dict()
+        chat_dict = new_chat.dict(exclude={'messages'})
         chat_dict['_id'] = chat_dict['id']
+        chat_dict['message_count'] = 0
+        chat_dict['search_title'] = search_text(new_chat.title)
+        chat_dict['version'] = 0
         
         await db.chats.insert_one(chat_dict)
-        return ChatResponse(success=True, chat=new_chat)
+        chat_cache.put(chat_dict)
+        return FastJSONResponse({"success": True, "chat": chat_payload(chat_dict, []), "message": None})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating chat: {str(e)}")
 
-@api_router.get("/chats", response_model=List[Chat])
-async def get_chats():
-    """Get all chats"""
+# Chat responses are revalidated with their ETag on every use
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+def conditional_response(content, if_none_match: Optional[str], headers: Optional[dict] = None) -> Response:
+    """JSON response tagged with the hash of its body, or 304 when the client has it already"""
+    response = FastJSONResponse(content)
+    etag = body_etag(response.body)
+    if etag_matches(if_none_match, etag):
+        response = not_modified(etag)
+    else:
+        response.headers.update(etag_headers(etag))
+    response.headers.update(headers or {})
+    return response
+
+# Fields needed to render the chat list
+CHAT_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "updated_at": 1,
+    "message_count": 1,
+    "last_message": 1,
+    # Only tells legacy chats that still embed their messages apart
+    "messages": {"$slice": 0},
+}
+
+@api_router.get("/chats", response_model=Union[ChatListResponse, List[Chat]])
+async def get_chats(
+    summary: bool = False,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get all chats, or a page of chat summaries when ``summary`` is set"""
     try:
-        chats = await db.chats.find().sort("updated_at", -1).to_list(100)
-        return [Chat(**{k: v for k, v in chat.items() if k != '_id'}) for chat in chats]
+        query = chats_after(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        if summary:
+            # Fetch one extra chat to know whether there is a next page
+            chats = await db.chats.find(query, CHAT_SUMMARY_PROJECTION).sort(CHAT_SORT).to_list(limit + 1)
+            next_cursor = None
+            if len(chats) > limit:
+                chats = chats[:limit]
+                next_cursor = encode_cursor(chats[-1]['updated_at'], chats[-1]['id'])
+            # Legacy chats only know their messages once they are migrated
+            for i, chat in enumerate(chats):
+                if 'messages' in chat:
+                    legacy = await db.chats.find_one({"id": chat['id']})
+                    if legacy:
+                        chats[i] = await migrate_chat(db, legacy)
+            return conditional_response({
+                "chats": [chat_summary_payload(chat) for chat in chats],
+                "next_cursor": next_cursor,
+            }, if_none_match)
+        
+        # The body stays a plain array; the next page is linked in the headers
+        chats = await db.chats.find(query).sort(CHAT_SORT).to_list(limit + 1)
+        headers = {}
+        if len(chats) > limit:
+            chats = chats[:limit]
+            next_cursor = encode_cursor(chats[-1]['updated_at'], chats[-1]['id'])
+            headers["Link"] = f'</api/chats?{urlencode({"limit": limit, "cursor": next_cursor})}>; rel="next"'
+        chats = [await migrate_chat(db, chat) for chat in chats]
+        messages = await load_messages_for_chats(db, chats)
+        return conditional_response(
+            [chat_payload(chat, messages[chat['id']]) for chat in chats], if_none_match, headers,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching chats: {str(e)}")
 
+# Most messages a search query ranks and reads (matching messages are all scored)
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '1000'))
+
+@api_router.get("/search", response_model=SearchResponse)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Search chat titles and messages, returning ranked chats with highlighted snippets"""
+    try:
+        hits, next_offset = await search_chats(db, q, limit, offset, SEARCH_MAX_CANDIDATES)
+        return SearchResponse(results=[SearchHit(**hit) for hit in hits], next_offset=next_offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching chats: {str(e)}")
+
+@api_router.get("/export")
+async def export_data(
+    kind: str = Query("chats", pattern="^(chats|messages)$"),
+    since: Optional[datetime] = None,
+    gzip: bool = False,
+):
+    """Stream all chats or messages (changed since ``since``) as NDJSON"""
+    chunks = export_ndjson(db, kind, since)
+    filename = f"{kind}.ndjson"
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@api_router.post("/import")
+async def import_data(request: Request, kind: str = Query("chats", pattern="^(chats|messages)$")):
+    """Upsert chats or messages from an NDJSON body (plain or gzip), as produced by the export"""
+    try:
+        result = await import_ndjson(db, kind, request.stream())
+        return result.dict()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing {kind}: {str(e)}")
+
+# Deleted chats are reported to delta sync clients for this long
+SYNC_TOMBSTONE_TTL = timedelta(seconds=int(os.environ.get('SYNC_TOMBSTONE_TTL', str(30 * 86400))))
+
+# Declared before /chats/{chat_id} so that "changes" is not taken for a chat id
+@api_router.get("/chats/changes")
+async def get_chat_changes(
+    since: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+):
+    """Chats and messages created or updated, and chats deleted, since a sync token"""
+    try:
+        return FastJSONResponse(await load_changes(db, since, limit, SYNC_TOMBSTONE_TTL))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SyncTokenExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching changes: {str(e)}")
+
 @api_router.get("/chats/{chat_id}", response_model=Chat)
-async def get_chat(chat_id: str):
-    """Get a specific chat with messages"""
+async def get_chat(
+    chat_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get a specific chat with its messages, or the last ``limit`` messages before ``before``"""
     try:
-        chat = await db.chats.find_one({"id": chat_id})
+        chat = await chat_cache.get(chat_id)
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
         
-        return Chat(**{k: v for k, v in chat.items() if k != '_id'})
+        chat = await migrate_chat(db, chat)
+        # Revalidation only needs the chat document
+        etag = chat_etag(chat, limit, before)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        return FastJSONResponse(
+            chat_payload(chat, await load_messages(db, chat, limit, before)),
+            headers=etag_headers(etag),
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching chat: {str(e)}")
 
+def forget_chats(chat_ids: List[str]):
+    """Drop in-process state of deleted chats"""
+    for chat_id in chat_ids:
+        chat_cache.discard(chat_id)
+        llm_clients.discard(session_id=chat_id)
+
+def invalidate_chats(chat_ids: List[str]):
+    """Drop cached copies of chats rewritten in the background"""
+    for chat_id in chat_ids:
+        chat_cache.discard(chat_id)
+
+# Deletes idle chats and caps long histories (both disabled by default); also serves deletions
+retention = RetentionEngine(
+    db,
+    SYNC_TOMBSTONE_TTL,
+    idle_days=float(os.environ.get('CHAT_RETENTION_DAYS', '0')),
+    max_messages=int(os.environ.get('CHAT_MAX_MESSAGES', '0')),
+    batch_size=int(os.environ.get('RETENTION_BATCH_SIZE', '500')),
+    pause=float(os.environ.get('RETENTION_BATCH_PAUSE', '0.1')),
+    forget=forget_chats,
+    invalidate=invalidate_chats,
+)
+
+class BulkDeleteRequest(BaseModel):
+    chat_ids: Optional[List[str]] = None
+    idle_days: Optional[float] = Field(None, gt=0)
+
+@api_router.post("/chats/bulk-delete")
+async def bulk_delete_chats(request: BulkDeleteRequest, dry_run: bool = Query(False)):
+    """Delete the chats matching every given filter, or only count them with ``dry_run``"""
+    query = {}
+    if request.chat_ids is not None:
+        query["id"] = {"$in": request.chat_ids}
+    if request.idle_days is not None:
+        query.update(idle_query(request.idle_days))
+    if not query:
+        raise HTTPException(status_code=400, detail="Give chat_ids or idle_days")
+    
+    try:
+        if dry_run:
+            counts = await retention.count(query)
+        else:
+            counts = await retention.delete_chats(query)
+        return {"dry_run": dry_run, **counts}
+    except Exception as e:
+        logging.error(f"Error in bulk_delete_chats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error deleting chats")
+
 @api_router.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: str):
     """Delete a chat"""
     try:
-        result = await db.chats.delete_one({"id": chat_id})
-        if result.deleted_count == 0:
+        deleted = await retention.delete_chats({"id": chat_id})
+        if deleted["chats"] == 0:
             raise HTTPException(status_code=404, detail="Chat not found")
         
         return {"message": "Chat deleted successfully"}
@@ -157,83 +650,348 @@ async def delete_chat(chat_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting chat: {str(e)}")
 
-@api_router.post("/chats/{chat_id}/messages")
-async def send_message(chat_id: str, message_data: MessageCreate):
-    """Send a message and get AI response"""
-    try:
-        # Get the chat
-        chat = await db.chats.find_one({"id": chat_id})
+CREDIT_COMMANDS = ("ovn", "cailbxrn")
+CREDIT_RESPONSE = "This app has been created by Nawaf and Abdallah @OVN531 and @TL-cailburex on Instagram"
+
+# Keyword routing rules, optionally loaded from a JSON rule table
+ROUTING_RULES_FILE = os.environ.get('ROUTING_RULES_FILE')
+intent_router = IntentRouter.from_file(ROUTING_RULES_FILE) if ROUTING_RULES_FILE else IntentRouter()
+
+def determine_chat_type(content: str) -> Optional[str]:
+    """Pick the AI route for a message, or None for the custom credit command"""
+    # Custom credit command
+    if content.lower().strip() in CREDIT_COMMANDS:
+        return None
+    
+    return intent_router.classify(content)
+
+async def get_chat_for_message(chat_id: str) -> dict:
+    """Load the chat a message is sent to, migrating legacy storage"""
+    chat = await chat_cache.get(chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    
+    # Move legacy embedded messages out of the chat document
+    return await migrate_chat(db, chat)
+
+def use_answer_cache(chat: dict) -> bool:
+    """Answers are only cached for the first turn of a chat, when there is no history.
+
+    A cached answer never reaches an AI session, so the cache needs the context
+    of later turns to be built from stored messages.
+    """
+    return answer_cache is not None and bool(CONTEXT_TOKEN_BUDGET) and not chat.get('message_count')
+
+def record_cache_hit(chat_type: str):
+    provider, model, _ = AI_ROUTES.get(chat_type, AI_ROUTES["general"])
+    metrics.llm_requests.inc(chat_type, provider, model, "cache_hit")
+
+async def get_ai_response(chat: dict, chat_type: str, content: str) -> str:
+    """Get the AI response to a message, from the answer cache when possible"""
+    cacheable = use_answer_cache(chat)
+    if cacheable:
+        cached = await answer_cache.get(chat_type, content)
+        if cached is not None:
+            record_cache_hit(chat_type)
+            return cached
+    
+    make_chat = await ai_chats_for_turn(chat, chat_type)
+    ai_response = await llm_router.send(chat_type, make_chat, llm.UserMessage(text=content))
+    
+    if cacheable:
+        await answer_cache.set(chat_type, content, ai_response)
+    return ai_response
+
+async def save_turn(chat_id: str, user_message: Message, ai_response: str, job_id: Optional[str] = None) -> dict:
+    """Append a user message and its AI response to a chat, tagged with the job answering it if any"""
+    assistant_message = Message(
+        role="assistant",
+        content=ai_response
+    )
+    
+    messages = [user_message.dict(), assistant_message.dict()]
+    if job_id:
+        for message in messages:
+            message['job_id'] = job_id
+    # Append both messages without rewriting the chat history
+    chat, first_seq = await append_messages(db, chat_id, messages)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    
+    # Update chat title if it's the first message
+    if first_seq == 0:
+        content = user_message.content
+        title = content[:30] + "..." if len(content) > 30 else content
+        chat = await db.chats.find_one_and_update(
+            {"id": chat_id},
+            {"$set": {"title": title, "search_title": search_text(title)}, "$inc": {"version": 1}},
+            projection={"messages": 0},
+            return_document=ReturnDocument.AFTER,
+        )
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
-        
-        # Create user message
-        user_message = Message(
-            role="user",
-            content=message_data.content
+    
+    chat_cache.put(chat)
+    if CONTEXT_TOKEN_BUDGET:
+        # Summarize turns that fell out of the window outside the turn
+        context_builder.schedule_refresh(chat_id)
+    return chat
+
+# Turns of the same chat are applied one at a time
+chat_turns = ChatTurnQueue(max_pending=int(os.environ.get('CHAT_MAX_PENDING_TURNS', '8')))
+
+def turn_queue_full(e: TurnQueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+def llm_unavailable(e: LlmUnavailable) -> HTTPException:
+    """Generic error for a route whose providers all failed; the details are only logged"""
+    if e.rejected:
+        # Overloaded: 429 when the wait queues were full, 503 when the wait budget ran out
+        logging.warning(f"AI providers overloaded: {str(e)}")
+        queue_full = all(error.reason == "queue_full" for error in e.errors)
+        return HTTPException(
+            status_code=429 if queue_full else 503,
+            detail="AI service is busy, please retry shortly",
+            headers={"Retry-After": str(min(error.retry_after for error in e.errors))},
         )
-        
-        # Add user message to chat
-        chat['messages'].append(user_message.dict())
-        
-        # Check for custom commands first
-        content_lower = message_data.content.lower().strip()
-        
-        # Custom credit command
-        if content_lower == "ovn" or content_lower == "cailbxrn":
-            ai_response = "This app has been created by Nawaf and Abdallah @OVN531 and @TL-cailburex on Instagram"
-        else:
-            # Determine chat type based on content
-            if any(keyword in content_lower for keyword in ['رياضيات', 'فيزياء', 'كيمياء', 'تاريخ', 'جغرافيا', 'دراسة', 'واجب', 'امتحان']):
-                chat_type = "educational"
-            elif any(keyword in content_lower for keyword in ['قصة', 'شعر', 'إبداع', 'كتابة', 'تأليف', 'فن']):
-                chat_type = "creative"
-            else:
-                chat_type = "general"
-            
-            # Get AI response
-            ai_chat = get_ai_chat(chat_type, chat_id)
-            user_msg = UserMessage(text=message_data.content)
-            ai_response = await ai_chat.send_message(user_msg)
-        
-        # Create assistant message
-        assistant_message = Message(
-            role="assistant",
-            content=ai_response
+    logging.error(f"AI providers failed: {str(e)}")
+    if e.timed_out:
+        return HTTPException(status_code=504, detail="AI service did not respond in time")
+    return HTTPException(status_code=502, detail="AI service is temporarily unavailable")
+
+async def answer_message(chat_id: str, content: str, limit: Optional[int], job_id: Optional[str] = None) -> dict:
+    """Answer a message and store the turn, returning the updated chat"""
+    # Read the chat inside the turn so it reflects the previous turns
+    chat = await get_chat_for_message(chat_id)
+    
+    # Create user message
+    user_message = Message(
+        role="user",
+        content=content
+    )
+    
+    chat_type = determine_chat_type(content)
+    if chat_type is None:
+        ai_response = CREDIT_RESPONSE
+    else:
+        # Get AI response
+        ai_response = await get_ai_response(chat, chat_type, content)
+    
+    chat = await save_turn(chat_id, user_message, ai_response, job_id)
+    
+    # Return the updated chat
+    return chat_payload(chat, await load_messages(db, chat, limit))
+
+async def answer_job(job: dict) -> dict:
+    """Answer the message of a job, unless an interrupted run already stored its turn"""
+    if await db.messages.find_one({"job_id": job['id']}, {"_id": 1}):
+        chat = await get_chat_for_message(job['chat_id'])
+        return chat_payload(chat, await load_messages(db, chat, job.get('limit')))
+    return await answer_message(job['chat_id'], job['content'], job.get('limit'), job['id'])
+
+async def run_message_job(job: dict) -> dict:
+    """Answer the message of a job, with the errors of ``send_message`` as ``JobFailed``"""
+    try:
+        return await chat_turns.run(job['chat_id'], ("job", job['id']), lambda: answer_job(job))
+    except HTTPException as e:
+        raise JobFailed(e.status_code, e.detail)
+    except TurnQueueFull as e:
+        raise JobFailed(429, str(e))
+    except LlmUnavailable as e:
+        error = llm_unavailable(e)
+        raise JobFailed(error.status_code, error.detail)
+
+# Messages sent in job mode are answered by a bounded pool of workers
+message_jobs = MessageJobs(
+    db,
+    run_message_job,
+    workers=int(os.environ.get('MESSAGE_JOB_WORKERS', '4')),
+    max_queue=int(os.environ.get('MESSAGE_JOB_MAX_QUEUE', '100')),
+    result_ttl=float(os.environ.get('MESSAGE_JOB_RESULT_TTL', '86400')),
+    lease=float(os.environ.get('MESSAGE_JOB_LEASE', '60')),
+)
+MESSAGE_JOB_MAX_WAIT = float(os.environ.get('MESSAGE_JOB_MAX_WAIT', '30'))
+
+def job_response(job: dict) -> Response:
+    """A job, 202 while it is pending and 200 once answered"""
+    return FastJSONResponse(
+        job_payload(job),
+        status_code=202 if job['status'] in ("queued", "running") else 200,
+        headers={"Location": f"/api/jobs/{job['id']}"},
+    )
+
+async def submit_message_job(chat_id: str, message_data: MessageCreate, key: Optional[str], limit: Optional[int]) -> Response:
+    await get_chat_for_message(chat_id)
+    try:
+        job, _ = await message_jobs.submit(chat_id, message_data.content, key, limit)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    return job_response(job)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0)):
+    """Get a message job, waiting up to ``wait`` seconds for its answer"""
+    job = await message_jobs.wait(job_id, min(wait, MESSAGE_JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@api_router.post("/chats/{chat_id}/messages")
+async def send_message(
+    chat_id: str,
+    message_data: MessageCreate,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    job_mode: bool = Query(False, alias="async"),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """Send a message and get AI response, returning the chat with its last ``limit`` messages.
+
+    With ``async=true`` the message is queued as a job instead and the response
+    is a 202 with the job, to be fetched from ``GET /api/jobs/{job_id}``.
+    """
+    if job_mode:
+        key = idempotency_key or message_data.client_message_id
+        return await submit_message_job(chat_id, message_data, key, limit)
+    try:
+        # A retry of a message still being answered shares its result; messages
+        # without a client id are always answered, even with the same content
+        turn_key = (message_data.client_message_id, limit) if message_data.client_message_id else None
+        chat = await chat_turns.run(
+            chat_id,
+            turn_key,
+            lambda: answer_message(chat_id, message_data.content, limit),
         )
-        
-        # Add assistant message to chat
-        chat['messages'].append(assistant_message.dict())
-        
-        # Update chat title if it's the first message
-        if len(chat['messages']) == 2:  # user + assistant message
-            chat['title'] = message_data.content[:30] + "..." if len(message_data.content) > 30 else message_data.content
-        
-        # Update timestamp
-        chat['updated_at'] = datetime.utcnow()
-        
-        # Save to database
-        await db.chats.replace_one({"id": chat_id}, chat)
-        
-        # Return the updated chat
-        return Chat(**{k: v for k, v in chat.items() if k != '_id'})
+        return FastJSONResponse(chat)
         
     except HTTPException:
         raise
+    except TurnQueueFull as e:
+        raise turn_queue_full(e)
+    except LlmUnavailable as e:
+        raise llm_unavailable(e)
     except Exception as e:
         logging.error(f"Error in send_message: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error processing message")
+
+# Keep references to reply tasks that outlive their HTTP request
+background_tasks = set()
+
+def sse_event(event: str, data) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+async def generate_reply(queue: asyncio.Queue, chat_id: str, user_message: Message, limit: Optional[int]):
+    """Stream the AI reply into ``queue`` and store the turn once generation ends.
+
+    Runs as its own task so the reply is still completed and stored when the
+    client disconnects in the middle of the stream.
+    """
+    parts = []
+    try:
+        chat = await get_chat_for_message(chat_id)
+        chat_type = determine_chat_type(user_message.content)
+        cacheable = chat_type is not None and use_answer_cache(chat)
+        cached = await answer_cache.get(chat_type, user_message.content) if cacheable else None
+        if cached is not None:
+            record_cache_hit(chat_type)
+        if chat_type is None or cached is not None:
+            ai_response = CREDIT_RESPONSE if chat_type is None else cached
+            parts.append(ai_response)
+            queue.put_nowait(ai_response)
+        else:
+            make_chat = await ai_chats_for_turn(chat, chat_type)
+            user_msg = llm.UserMessage(text=user_message.content)
+            async for token in llm_router.stream(chat_type, make_chat, user_msg, stream_reply):
+                parts.append(token)
+                queue.put_nowait(token)
+            if cacheable:
+                await answer_cache.set(chat_type, user_message.content, "".join(parts))
+        
+        chat = await save_turn(chat_id, user_message, "".join(parts))
+        queue.put_nowait(chat_payload(chat, await load_messages(db, chat, limit)))
+    except LlmUnavailable as e:
+        queue.put_nowait(llm_unavailable(e))
+    except Exception as e:
+        logging.error(f"Error in stream_message: {str(e)}")
+        queue.put_nowait(e)
+
+@api_router.post("/chats/{chat_id}/messages/stream")
+async def stream_message(
+    chat_id: str,
+    message_data: MessageCreate,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+):
+    """Send a message and stream the AI response as Server-Sent Events.
+
+    Emits ``token`` events as the reply is generated, then a ``done`` event with
+    the updated chat (last ``limit`` messages), or an ``error`` event.
+    """
+    await get_chat_for_message(chat_id)
+    if chat_turns.pending(chat_id) >= chat_turns.max_pending:
+        raise turn_queue_full(TurnQueueFull(f"Too many pending messages for chat {chat_id}"))
+    
+    user_message = Message(
+        role="user",
+        content=message_data.content
+    )
+    
+    queue = asyncio.Queue()
+    
+    async def run_turn():
+        try:
+            await chat_turns.run(chat_id, None, lambda: generate_reply(queue, chat_id, user_message, limit))
+        except TurnQueueFull as e:
+            queue.put_nowait(e)
+    
+    task = asyncio.create_task(run_turn())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    
+    async def events():
+        while True:
+            item = await queue.get()
+            if isinstance(item, str):
+                yield sse_event("token", {"content": item})
+            elif isinstance(item, HTTPException):
+                yield sse_event("error", {"detail": item.detail})
+                return
+            elif isinstance(item, TurnQueueFull):
+                yield sse_event("error", {"detail": str(item)})
+                return
+            elif isinstance(item, Exception):
+                yield sse_event("error", {"detail": "Error processing message"})
+                return
+            else:
+                yield sse_event("done", item)
+                return
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @api_router.put("/chats/{chat_id}/title")
 async def update_chat_title(chat_id: str, title_data: dict):
     """Update chat title"""
     try:
-        result = await db.chats.update_one(
+        chat = await db.chats.find_one_and_update(
             {"id": chat_id},
-            {"$set": {"title": title_data["title"], "updated_at": datetime.utcnow()}}
+            {
+                "$set": {
+                    "title": title_data["title"],
+                    "search_title": search_text(title_data["title"]),
+                    "updated_at": datetime.utcnow(),
+                },
+                "$inc": {"version": 1},
+            },
+            projection={"messages": 0},
+            return_document=ReturnDocument.AFTER,
         )
         
-        if result.matched_count == 0:
+        if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
+        chat_cache.put(chat)
         
         return {"message": "Title updated successfully"}
     except HTTPException:
@@ -244,12 +1002,40 @@ async def update_chat_title(chat_id: str, title_data: dict):
 # Include the router in the main app
 app.include_router(api_router)
 
+if METRICS_ENABLED:
+    # Export the runtime counters of /api/stats as gauges
+    component_stats = metrics.registry.gauge(
+        "faisal_component_stat", "Runtime counters of server components", ("component", "stat"),
+    )
+    for component, stats in [
+        ("llm_clients", llm_clients.stats),
+        ("answer_cache", lambda: answer_cache.stats() if answer_cache else None),
+        ("context", context_builder.stats),
+        ("chat_turns", chat_turns.stats),
+        ("llm_routes", llm_router.stats),
+        ("chat_archive", lambda: chat_archiver.stats() if chat_archiver else None),
+        ("message_jobs", message_jobs.stats),
+        ("chat_cache", chat_cache.stats),
+        ("retention", retention.stats),
+    ]:
+        metrics.registry.add_collector(metrics.stats_collector(component_stats, stats, [component]))
+    metrics.registry.add_collector(llm_admission.collect)
+    
+    app.add_middleware(
+        metrics.MetricsMiddleware,
+        duration=metrics.http_request_duration,
+        in_flight=metrics.http_requests_in_flight,
+        timing_header=os.environ.get('METRICS_TIMING_HEADERS', '0') == '1',
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients follow the next page of the full chat list
+    expose_headers=["Link"],
 )
 
 # Configure logging
@@ -258,7 +1044,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
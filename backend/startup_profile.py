@@ -0,0 +1,91 @@
+"""Startup profiling.
+
+Init steps of the server (Mongo client, LLM provider, database preparation)
+are always timed. With ``STARTUP_PROFILE=1`` in the process environment, the
+import time of every top-level module imported after this one is recorded too,
+children included, e.g. ``fastapi`` or ``emergentintegrations``. The profile is
+logged once the app is ready and reported by ``/api/stats`` under ``startup``;
+when ``STARTUP_BUDGET_SECONDS`` is set, a slower start is logged as a warning.
+
+This module must be imported before the modules it should time.
+"""
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Imports shown in the log, slowest first
+REPORT_IMPORTS = 15
+
+
+class StartupProfile:
+    def __init__(self, budget: Optional[float] = None):
+        self.started = time.perf_counter()
+        self.budget = budget
+        self.imports: Dict[str, float] = {}
+        self.init: Dict[str, float] = {}
+        self.ready_seconds: Optional[float] = None
+        self._original_import = None
+        self._local = threading.local()
+
+    def install(self):
+        """Time first imports from now on"""
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._local.depth = depth
+            if not depth:
+                # Only outermost imports, which include the modules they import
+                top = name.partition('.')[0]
+                self.imports[top] = self.imports.get(top, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def step(self, name: str):
+        """Time an init step"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.init[name] = self.init.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self):
+        """Record the time to ready and log the profile"""
+        self.ready_seconds = time.perf_counter() - self.started
+        steps = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.init.items())
+        logger.info(f"Started in {self.ready_seconds:.3f}s ({steps})")
+        if self._original_import is not None:
+            for name, seconds in self.slowest_imports():
+                logger.info(f"Import {name}: {seconds:.3f}s")
+        if self.budget and self.ready_seconds > self.budget:
+            logger.warning(f"Startup took {self.ready_seconds:.3f}s, over the {self.budget:.3f}s budget")
+
+    def slowest_imports(self):
+        return sorted(self.imports.items(), key=lambda item: -item[1])[:REPORT_IMPORTS]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "ready_seconds": self.ready_seconds,
+            "budget_seconds": self.budget,
+            "init_seconds": dict(self.init),
+            "import_seconds": dict(self.slowest_imports()) if self._original_import is not None else None,
+        }
+
+
+profile = StartupProfile(budget=float(os.environ.get('STARTUP_BUDGET_SECONDS', '0')) or None)
+if os.environ.get('STARTUP_PROFILE', '0') == '1':
+    profile.install()
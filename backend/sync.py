@@ -0,0 +1,179 @@
+"""Conditional requests and delta sync for chats.
+
+Chat responses carry a weak ETag so that a client reloading an unchanged chat
+gets a bodiless 304. For a single chat the tag is derived from the chat
+document alone (its ``version`` changes with every write to the chat, trimming
+old messages included), so a revalidation reads no messages.
+
+``load_changes`` returns what changed since a sync token: chats created or
+updated, their new messages, and deleted chats, which leave a tombstone behind
+for as long as tokens stay valid. A token holds the sync point (when the client
+was last caught up, none for a first sync), the time the first page of the
+current sync started and a keyset position in ``(updated_at, id)`` order. Pages
+of one sync advance the position but keep the sync point, which selects the
+messages to return. Deletions are selected from the sync point, or on a first
+sync from its start, since chats deleted earlier were never listed. Once caught
+up, the next sync point is placed a few seconds before the sync started, so
+that writes during the sync or still in flight are picked up next time
+(clients apply changes idempotently by ``id``).
+"""
+import base64
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReplaceOne
+
+from chat_archive import load_archived_for_chats
+from pagination import InvalidCursor
+from serialization import chat_summary_payload, message_payload
+
+# Tolerance for writes in flight when a sync runs
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class SyncTokenExpired(Exception):
+    pass
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def chat_etag(chat: dict, *params) -> str:
+    """ETag of a chat response, from the chat document and the request parameters"""
+    return make_etag(
+        chat['id'], chat.get('message_count', 0), chat.get('version', 0), chat['title'], chat['updated_at'], *params,
+    )
+
+
+def body_etag(body: bytes) -> str:
+    return make_etag(hashlib.sha1(body).hexdigest())
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag`` (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+async def record_tombstones(db, chat_ids: List[str], ttl: timedelta):
+    """Remember deleted chats until sync tokens that may predate them expire"""
+    now = datetime.utcnow()
+    await db.chat_tombstones.bulk_write([
+        ReplaceOne(
+            {"_id": chat_id},
+            {"_id": chat_id, "chat_id": chat_id, "deleted_at": now, "expires_at": now + ttl},
+            upsert=True,
+        )
+        for chat_id in chat_ids
+    ], ordered=False)
+
+
+def encode_sync_token(
+    since: Optional[datetime], sync_started: Optional[datetime], position: datetime, after_id: str,
+) -> str:
+    """Encode a sync point (``None`` for a first sync), the start of the sync in
+    progress (``None`` when the token starts a new one) and a keyset position"""
+    optional = [value.isoformat() if value else "" for value in (since, sync_started)]
+    raw = f"{optional[0]}|{optional[1]}|{position.isoformat()}|{after_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> Tuple[Optional[datetime], Optional[datetime], datetime, str]:
+    """Decode a token produced by ``encode_sync_token``"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        since, sync_started, position, after_id = raw.split("|", 3)
+        return (
+            datetime.fromisoformat(since) if since else None,
+            datetime.fromisoformat(sync_started) if sync_started else None,
+            datetime.fromisoformat(position),
+            after_id,
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid sync token: {token}") from e
+
+
+async def load_changes(db, token: Optional[str], limit: int, tombstone_ttl: timedelta) -> dict:
+    """Chats, messages and deletions since ``token`` (everything when it is ``None``).
+
+    Raises ``InvalidCursor`` for a malformed token and ``SyncTokenExpired``
+    when tombstones older than the token may already be gone.
+    """
+    started = datetime.utcnow()
+    query = {}
+    since = None
+    sync_started = None
+    if token:
+        since, sync_started, position, after_id = decode_sync_token(token)
+        if since is not None and since < started - tombstone_ttl:
+            raise SyncTokenExpired("Sync token expired, reload all chats")
+        query = {
+            "$or": [
+                {"updated_at": {"$gt": position}},
+                {"updated_at": position, "id": {"$gt": after_id}},
+            ]
+        }
+
+    # Later pages of a sync keep the start of its first page
+    sync_started = sync_started or started
+
+    chats = await db.chats.find(
+        query,
+        {"_id": 0, "id": 1, "title": 1, "updated_at": 1, "message_count": 1, "last_message": 1},
+    ).sort([("updated_at", 1), ("id", 1)]).to_list(limit + 1)
+    has_more = len(chats) > limit
+    chats = chats[:limit]
+
+    messages = []
+    if chats:
+        message_query = {"chat_id": {"$in": [chat['id'] for chat in chats]}}
+        if since is not None:
+            message_query["stored_at"] = {"$gt": since}
+        cursor = db.messages.find(
+            message_query,
+            {"_id": 0, "chat_id": 1, "id": 1, "role": 1, "content": 1, "timestamp": 1, "seq": 1},
+        ).sort([("chat_id", 1), ("seq", 1)])
+        messages = [
+            {"chat_id": message['chat_id'], **message_payload(message)}
+            async for message in cursor
+        ]
+        # Histories compacted since the token was issued are read from the archive
+        for chat_id, archived in (await load_archived_for_chats(db, [chat['id'] for chat in chats])).items():
+            messages.extend(
+                {"chat_id": chat_id, **message_payload(message)}
+                for message in archived
+                if since is None or message['timestamp'] > since
+            )
+
+    # A first sync reports chats deleted after it started, which earlier pages may have listed
+    deleted_since = since if since is not None else sync_started - SYNC_OVERLAP
+    tombstones = db.chat_tombstones.find({"deleted_at": {"$gt": deleted_since}}, {"chat_id": 1})
+    deleted = [tombstone['chat_id'] async for tombstone in tombstones]
+
+    if has_more:
+        next_token = encode_sync_token(since, sync_started, chats[-1]['updated_at'], chats[-1]['id'])
+    else:
+        caught_up = max(sync_started - SYNC_OVERLAP, since or datetime.min)
+        next_token = encode_sync_token(caught_up, None, caught_up, "")
+
+    return {
+        "chats": [chat_summary_payload(chat) for chat in chats],
+        "messages": messages,
+        "deleted": deleted,
+        "next_token": next_token,
+        "has_more": has_more,
+    }
@@ -161,6 +161,28 @@ class FaisalBackendTester:
             self.log_test("Get All Chats", False, f"Get chats exception: {str(e)}")
             return False
     
+    async def get_chat_summaries(self) -> bool:
+        """Get paginated chat summaries"""
+        try:
+            params = {"summary": "true", "limit": 1}
+            async with self.session.get(f"{BACKEND_URL}/chats", params=params) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    chats = data.get("chats") if isinstance(data, dict) else None
+                    if isinstance(chats, list) and len(chats) <= 1 and all("messages" not in chat for chat in chats):
+                        self.log_test("Get Chat Summaries", True, f"Retrieved {len(chats)} chat summaries, next cursor: {bool(data.get('next_cursor'))}")
+                        return True
+                    else:
+                        self.log_test("Get Chat Summaries", False, "Invalid summary response structure", {"response": data})
+                        return False
+                else:
+                    error_text = await response.text()
+                    self.log_test("Get Chat Summaries", False, f"Get chat summaries failed with status {response.status}", {"error": error_text})
+                    return False
+        except Exception as e:
+            self.log_test("Get Chat Summaries", False, f"Get chat summaries exception: {str(e)}")
+            return False
+    
     async def get_chat(self, chat_id: str) -> bool:
         """Get specific chat"""
         try:
@@ -280,6 +302,9 @@ class FaisalBackendTester:
                 # Test 5: Get all chats
                 await self.get_chats()
                 
+                # Test 5b: Get chat summaries
+                await self.get_chat_summaries()
+                
                 # Test 6: AI Model routing
                 await self.test_ai_model_routing()
                 
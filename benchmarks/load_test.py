@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Faisal backend.
+
+Drives a mix of create / list / open / send requests at one or more
+concurrency levels and reports p50/p95/p99 latency and requests per second
+per operation. By default the FastAPI app runs in-process against an
+in-memory Mongo stand-in (mongomock-motor) and the fake LLM provider, so no
+network, database or API key is needed. Use --url to target a running server
+(e.g. a local uvicorn) instead.
+
+Results are written as JSON; pass --compare with an earlier result file to
+print the change per operation.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 500
+    python benchmarks/load_test.py --url http://localhost:8001 --concurrency 16
+    python benchmarks/load_test.py --compare benchmarks/results/previous.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+PROMPTS = [
+    "ساعدني في حل مسألة رياضيات صعبة",
+    "أريد كتابة قصة قصيرة عن الصداقة",
+    "ما هو الطقس اليوم؟",
+    "ساعدني في دراسة الفيزياء للامتحان",
+    "ما هو قانون نيوتن الثاني",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], seed: int):
+        self.client = client
+        self.mix = mix
+        self.rng = random.Random(seed)
+        self.chat_ids: List[str] = []
+
+    async def create(self):
+        response = await self.client.post("/api/chats", json={"title": "محادثة اختبار"})
+        response.raise_for_status()
+        self.chat_ids.append(response.json()["chat"]["id"])
+
+    async def list(self):
+        response = await self.client.get("/api/chats", params={"summary": "true", "limit": 50})
+        response.raise_for_status()
+
+    async def open(self):
+        chat_id = self.rng.choice(self.chat_ids)
+        response = await self.client.get(f"/api/chats/{chat_id}", params={"limit": 50})
+        response.raise_for_status()
+
+    async def send(self):
+        chat_id = self.rng.choice(self.chat_ids)
+        payload = {"content": self.rng.choice(PROMPTS), "chat_id": chat_id}
+        response = await self.client.post(f"/api/chats/{chat_id}/messages", params={"limit": 50}, json=payload)
+        response.raise_for_status()
+
+    async def run_level(self, concurrency: int, total_requests: int) -> Dict[str, Dict[str, float]]:
+        operations = list(self.mix)
+        weights = [self.mix[op] for op in operations]
+        latencies: Dict[str, List[float]] = {op: [] for op in operations}
+        errors: Dict[str, int] = {op: 0 for op in operations}
+        remaining = [total_requests]
+
+        async def worker():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                op = self.rng.choices(operations, weights)[0]
+                start = time.perf_counter()
+                try:
+                    await getattr(self, op)()
+                    latencies[op].append(time.perf_counter() - start)
+                except Exception:
+                    errors[op] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+        report = {op: summarize(latencies[op], errors[op], elapsed) for op in operations}
+        report["all"] = summarize(
+            [value for values in latencies.values() for value in values],
+            sum(errors.values()),
+            elapsed,
+        )
+        return report
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def configure_in_process(args):
+    """Environment for the in-process app: in-memory Mongo and the fake LLM"""
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = "faisal_load_test"
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SEC"] = str(args.llm_tokens_per_sec)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+async def run(args) -> dict:
+    mix = {"create": args.create, "list": args.list, "open": args.open, "send": args.send}
+    mix = {op: weight for op, weight in mix.items() if weight > 0}
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        lifespan = None
+    else:
+        configure_in_process(args)
+        import server
+
+        lifespan = server.app.router.lifespan_context(server.app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app),
+            base_url="http://load-test",
+            timeout=args.timeout,
+        )
+
+    levels = {}
+    try:
+        tester = LoadTest(client, mix, args.seed)
+        for _ in range(args.seed_chats):
+            await tester.create()
+        for concurrency in args.concurrency:
+            levels[str(concurrency)] = await tester.run_level(concurrency, args.requests)
+            overall = levels[str(concurrency)]["all"]
+            print(
+                f"concurrency {concurrency:>4}: {overall['rps']:8.1f} req/s  "
+                f"p50 {overall['p50_ms']:7.1f} ms  p95 {overall['p95_ms']:7.1f} ms  "
+                f"p99 {overall['p99_ms']:7.1f} ms  errors {overall['errors']}"
+            )
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "target": args.url or "in-process",
+        "config": {
+            "requests_per_level": args.requests,
+            "mix": mix,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_tokens_per_sec": args.llm_tokens_per_sec,
+            "seed_chats": args.seed_chats,
+        },
+        "levels": levels,
+    }
+
+
+def compare(current: dict, previous: dict):
+    """Print the relative change of p95 latency and throughput per operation"""
+    print(f"\nCompared with {previous.get('commit')} ({previous.get('timestamp')}):")
+    for level, operations in current["levels"].items():
+        for op, stats in operations.items():
+            before = previous.get("levels", {}).get(level, {}).get(op)
+            if not before:
+                continue
+            p95 = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            rps = (stats["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+            print(f"  c={level:>4} {op:>6}: p95 {p95:+6.1f}%  rps {rps:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--mongo-url", default="mongomock://", help="Mongo URL for the in-process app")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=300, help="Requests per concurrency level")
+    parser.add_argument("--seed-chats", type=int, default=20)
+    parser.add_argument("--create", type=float, default=1, help="Weight of create requests")
+    parser.add_argument("--list", type=float, default=3, help="Weight of list requests")
+    parser.add_argument("--open", type=float, default=3, help="Weight of open requests")
+    parser.add_argument("--send", type=float, default=3, help="Weight of send requests")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Fake LLM time to first token")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=0, help="Fake LLM token rate (0 = instant)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"load-{result['commit']}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Routing micro-benchmark.
+
+Compares the compiled keyword automaton in backend/intent_router.py with the
+previous linear ``any(keyword in content ...)`` scans while the rule table
+grows, to check that routing cost stays flat with the number of keywords.
+
+Usage: python benchmarks/router_bench.py [--sizes 10 100 1000 10000] [--runs 2000]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from arabic_text import normalize_arabic  # noqa: E402
+from intent_router import DEFAULT_RULES, IntentRouter, RoutingRule  # noqa: E402
+
+ARABIC_LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+MESSAGES = [
+    "ساعدني في حل مسألة رياضيات صعبة",
+    "أريد كتابة قصة قصيرة عن الصداقة",
+    "ما هو الطقس اليوم؟",
+    "ساعدني في دراسة الفيزياء للامتحان",
+    "أريد إبداع شعر عن الطبيعة",
+    "اشرح لي الفرق بين الخلية النباتية والخلية الحيوانية بالتفصيل مع أمثلة من الحياة اليومية",
+]
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(ARABIC_LETTERS) for _ in range(rng.randint(4, 8)))
+
+
+def build_rules(size: int, rng: random.Random):
+    """The default rules padded with random keywords up to ``size`` keywords"""
+    rules = list(DEFAULT_RULES)
+    extra = size - sum(len(rule.keywords) for rule in rules)
+    routes = ["educational", "creative", "general"]
+    for i in range(max(extra, 0)):
+        rules.append(RoutingRule(routes[i % len(routes)], [random_word(rng)], weight=rng.random(), priority=i % 3))
+    return rules
+
+
+def linear_scan(rules, text: str) -> str:
+    """Baseline: one substring scan per keyword, as the original router did"""
+    content = normalize_arabic(text)
+    for rule in sorted(rules, key=lambda rule: -rule.priority):
+        if any(keyword in content for keyword in rule.keywords):
+            return rule.route
+    return "general"
+
+
+def time_per_call(func, runs: int) -> float:
+    start = time.perf_counter()
+    for i in range(runs):
+        func(MESSAGES[i % len(MESSAGES)])
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[14, 100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'keywords':>10} {'build ms':>10} {'automaton us':>14} {'linear us':>12}")
+    for size in args.sizes:
+        rules = build_rules(size, rng)
+        start = time.perf_counter()
+        router = IntentRouter(rules)
+        build_ms = (time.perf_counter() - start) * 1e3
+        automaton_us = time_per_call(router.classify, args.runs)
+        linear_us = time_per_call(lambda text: linear_scan(rules, text), args.runs)
+        print(f"{size:>10} {build_ms:>10.1f} {automaton_us:>14.1f} {linear_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Chat response serialization micro-benchmark.
+
+Compares, for chats of growing size, the previous response path (a ``Chat``
+model built from the stored documents, validated again by FastAPI through
+``response_model`` and encoded with the standard library) with the current
+one (documents mapped straight to the response shape by
+backend/serialization.py and encoded with orjson, or the standard library when
+orjson is not installed). Also checks that both paths produce the same JSON.
+
+Usage: python benchmarks/serialization_bench.py [--messages 10 100 1000] [--runs 200]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# The server module is only imported for its models; no database is used
+os.environ["MONGO_URL"] = "mongomock://"
+os.environ["DB_NAME"] = "faisal_serialization_bench"
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["METRICS_ENABLED"] = "0"
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import serialization  # noqa: E402
+import server  # noqa: E402
+
+CHAT_FIELD = create_response_field(name="Response_get_chat", type_=server.Chat, mode="serialization")
+
+CONTENT = "هذا شرح مفصل لقانون نيوتن الثاني: القوة تساوي الكتلة في التسارع. " * 4
+
+
+def stored_chat(message_count: int):
+    """A chat document and its messages as read from Mongo"""
+    chat_id = str(uuid.uuid4())
+    start = datetime(2024, 1, 1, 12, 0, 0, 123000)
+    chat = {
+        "_id": chat_id,
+        "id": chat_id,
+        "title": "مساعدة في الفيزياء",
+        "message_count": message_count,
+        "created_at": start,
+        "updated_at": start + timedelta(minutes=message_count),
+        "last_message": CONTENT[:80],
+        "search_title": "مساعده في فيزياء",
+    }
+    messages = [
+        {
+            "id": str(uuid.uuid4()),
+            "role": "user" if seq % 2 == 0 else "assistant",
+            "content": CONTENT,
+            "timestamp": start + timedelta(seconds=seq, milliseconds=seq % 1000),
+            "seq": seq,
+        }
+        for seq in range(message_count)
+    ]
+    return chat, messages
+
+
+async def model_path(chat: dict, messages: list) -> bytes:
+    """Previous path: pydantic model, response_model validation, stdlib JSON"""
+    chat_data = {k: v for k, v in chat.items() if k not in ('_id', 'messages')}
+    model = server.Chat(**chat_data, messages=messages)
+    content = await serialize_response(field=CHAT_FIELD, response_content=model)
+    return JSONResponse(content).body
+
+
+async def document_path(chat: dict, messages: list) -> bytes:
+    """Current path: documents mapped to the response shape and encoded directly"""
+    return serialization.FastJSONResponse(serialization.chat_payload(chat, messages)).body
+
+
+async def time_per_call(path, chat, messages, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        await path(chat, messages)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+async def run(args):
+    orjson = serialization.orjson
+    print(f"orjson: {'available' if orjson else 'not installed'}")
+    print(f"{'messages':>10} {'model us':>12} {'document us':>13} {'stdlib us':>11} {'speed-up':>9}")
+    for count in args.messages:
+        chat, messages = stored_chat(count)
+        before = await model_path(chat, messages)
+        after = await document_path(chat, messages)
+        assert json.loads(before) == json.loads(after), "response bodies differ"
+
+        runs = max(1, args.runs * 10 // max(count, 10))
+        model_us = await time_per_call(model_path, chat, messages, runs)
+        document_us = await time_per_call(document_path, chat, messages, runs)
+        # The document path without orjson
+        serialization.orjson = None
+        stdlib_us = await time_per_call(document_path, chat, messages, runs)
+        serialization.orjson = orjson
+        print(f"{count:>10} {model_us:>12.1f} {document_us:>13.1f} {stdlib_us:>11.1f} {model_us / document_us:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, nargs="+", default=[0, 10, 100, 1000])
+    parser.add_argument("--runs", type=int, default=200, help="Runs for a 10-message chat, scaled by size")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
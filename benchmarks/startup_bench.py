@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Worker cold-start benchmark.
+
+Starts the app in fresh interpreters, as a new worker would, against an
+in-memory database and the offline LLM provider, and reports the time to
+import backend/server.py and the time until the app is ready, plus the
+slowest imports recorded by the startup profile (backend/startup_profile.py).
+Exits with status 1 when the median time to ready is over ``--budget``.
+
+Usage: python benchmarks/startup_bench.py [--runs 5] [--budget 1.5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+
+WORKER = """
+import asyncio, json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter() - start
+
+async def main():
+    async with server.lifespan(server.app):
+        while server.startup_profile.ready_seconds is None:
+            await asyncio.sleep(0.005)
+
+asyncio.run(main())
+print(json.dumps({
+    "import_seconds": imported,
+    "ready_seconds": time.perf_counter() - start,
+    "imports": server.startup_profile.stats()["import_seconds"],
+}))
+"""
+
+
+def start_worker() -> dict:
+    env = {
+        **os.environ,
+        "MONGO_URL": "mongomock://",
+        "DB_NAME": "faisal_startup_bench",
+        "LLM_PROVIDER": "fake",
+        "STARTUP_PROFILE": "1",
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER],
+        cwd=BACKEND, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None, help="Maximum median seconds to ready")
+    args = parser.parse_args()
+
+    runs = [start_worker() for _ in range(args.runs)]
+    import_median = statistics.median(run["import_seconds"] for run in runs)
+    ready_median = statistics.median(run["ready_seconds"] for run in runs)
+    print(f"import server: {import_median * 1000:.0f} ms (median of {args.runs})")
+    print(f"ready:         {ready_median * 1000:.0f} ms")
+    print("slowest imports (last run):")
+    for name, seconds in list(runs[-1]["imports"].items())[:10]:
+        print(f"  {name:<24} {seconds * 1000:>7.1f} ms")
+
+    if args.budget is not None and ready_median > args.budget:
+        print(f"over budget: {ready_median:.3f}s > {args.budget:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,15 +30,17 @@ const ChatInterface = () => {
   const [sidebarOpen, setSidebarOpen] = useState(true);
   const messagesEndRef = useRef(null);
   const { theme, toggleTheme } = useTheme();
-  const { currentChat, sendMessage, isTyping } = useChat();
+  const { currentChat, sendMessage, isTyping, hasOlderMessages, loadOlderMessages } = useChat();
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Only follow new messages at the bottom, not older history loaded above
+  const lastMessageId = currentChat?.messages?.[currentChat.messages.length - 1]?.id;
   useEffect(() => {
     scrollToBottom();
-  }, [currentChat?.messages]);
+  }, [lastMessageId]);
 
   const handleSendMessage = async () => {
     if (!message.trim()) return;
@@ -158,8 +160,16 @@ const ChatInterface = () => {
               </div>
             )}
             
+            {hasOlderMessages && (
+              <div className="text-center">
+                <Button variant="ghost" size="sm" onClick={loadOlderMessages}>
+                  تحميل الرسائل السابقة
+                </Button>
+              </div>
+            )}
+            
             {currentChat?.messages?.map((msg, index) => (
-              <MessageBubble key={index} message={msg} />
+              <MessageBubble key={msg.id || index} message={msg} />
             ))}
             
             {isTyping && (
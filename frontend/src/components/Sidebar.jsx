@@ -15,7 +15,7 @@ import {
 import { useChat } from '../contexts/ChatContext';
 
 const Sidebar = ({ isOpen, onToggle }) => {
-  const { chats, currentChatId, createNewChat, switchChat, deleteChat } = useChat();
+  const { chats, currentChatId, createNewChat, switchChat, deleteChat, hasMoreChats, loadMoreChats } = useChat();
 
   return (
     <div className={`fixed left-0 top-0 h-full bg-card border-r border-border transition-transform duration-300 z-30 ${
@@ -64,6 +64,16 @@ const Sidebar = ({ isOpen, onToggle }) => {
                 </div>
               </div>
             ))}
+            {hasMoreChats && (
+              <Button
+                variant="ghost"
+                size="sm"
+                className="w-full text-sm text-muted-foreground"
+                onClick={loadMoreChats}
+              >
+                عرض المزيد
+              </Button>
+            )}
           </div>
         </ScrollArea>
 
@@ -4,6 +4,17 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Number of messages fetched when a chat is opened and per "load older" page
+const MESSAGE_PAGE_SIZE = 50;
+
+// Keep already loaded older messages when the server returns only the latest page
+const mergeMessages = (existing = [], incoming = []) => {
+  const firstSeq = incoming.length > 0 ? incoming[0].seq : undefined;
+  if (firstSeq === undefined || firstSeq === null) return incoming;
+  const older = existing.filter(msg => msg.seq !== undefined && msg.seq !== null && msg.seq < firstSeq);
+  return [...older, ...incoming];
+};
+
 const ChatContext = createContext();
 
 export const useChat = () => {
@@ -19,19 +30,31 @@ export const ChatProvider = ({ children }) => {
   const [currentChatId, setCurrentChatId] = useState(null);
   const [isTyping, setIsTyping] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
+  const [nextChatsCursor, setNextChatsCursor] = useState(null);
 
   // Load chats from backend on mount
   useEffect(() => {
     loadChats();
   }, []);
 
+  // Fetch the latest messages of a chat the first time it is opened
+  useEffect(() => {
+    const chat = chats.find(c => c.id === currentChatId);
+    if (chat && !chat.messages) {
+      loadChatMessages(currentChatId);
+    }
+  }, [currentChatId, chats]);
+
   const loadChats = async () => {
     try {
       setIsLoading(true);
-      const response = await axios.get(`${API}/chats`);
-      setChats(response.data);
-      if (response.data.length > 0 && !currentChatId) {
-        setCurrentChatId(response.data[0].id);
+      const response = await axios.get(`${API}/chats`, {
+        params: { summary: true }
+      });
+      setChats(response.data.chats);
+      setNextChatsCursor(response.data.next_cursor);
+      if (response.data.chats.length > 0 && !currentChatId) {
+        setCurrentChatId(response.data.chats[0].id);
       }
     } catch (error) {
       console.error('Error loading chats:', error);
@@ -40,6 +63,51 @@ export const ChatProvider = ({ children }) => {
     }
   };
 
+  const loadMoreChats = async () => {
+    if (!nextChatsCursor) return;
+    try {
+      const response = await axios.get(`${API}/chats`, {
+        params: { summary: true, cursor: nextChatsCursor }
+      });
+      setChats(prev => [...prev, ...response.data.chats]);
+      setNextChatsCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more chats:', error);
+    }
+  };
+
+  const loadChatMessages = async (chatId) => {
+    try {
+      const response = await axios.get(`${API}/chats/${chatId}`, {
+        params: { limit: MESSAGE_PAGE_SIZE }
+      });
+      setChats(prev => prev.map(chat =>
+        chat.id === chatId ? response.data : chat
+      ));
+    } catch (error) {
+      console.error('Error loading chat:', error);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    const chat = chats.find(c => c.id === currentChatId);
+    const oldestSeq = chat?.messages?.[0]?.seq;
+    if (!oldestSeq) return;
+
+    try {
+      const response = await axios.get(`${API}/chats/${currentChatId}`, {
+        params: { limit: MESSAGE_PAGE_SIZE, before: oldestSeq }
+      });
+      setChats(prev => prev.map(c =>
+        c.id === currentChatId
+          ? { ...c, messages: [...response.data.messages, ...(c.messages || [])] }
+          : c
+      ));
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    }
+  };
+
   const createNewChat = async () => {
     try {
       const response = await axios.post(`${API}/chats`, {
@@ -118,12 +186,17 @@ export const ChatProvider = ({ children }) => {
     try {
       const response = await axios.post(`${API}/chats/${currentChatId}/messages`, {
         content: content.trim(),
-        chat_id: currentChatId
+        chat_id: currentChatId,
+        client_message_id: userMessage.id
+      }, {
+        params: { limit: MESSAGE_PAGE_SIZE }
       });
 
-      // Update the chat with the complete response from backend
+      // Update the chat with the latest messages from backend
       setChats(prev => prev.map(chat => 
-        chat.id === currentChatId ? response.data : chat
+        chat.id === currentChatId
+          ? { ...response.data, messages: mergeMessages(chat.messages, response.data.messages) }
+          : chat
       ));
 
     } catch (error) {
@@ -161,6 +234,9 @@ export const ChatProvider = ({ children }) => {
   };
 
   const currentChat = chats.find(chat => chat.id === currentChatId);
+  // Messages before trimmed_upto were deleted by retention
+  const hasOlderMessages = (currentChat?.messages?.[0]?.seq || 0) > (currentChat?.trimmed_upto || 0);
+  const hasMoreChats = Boolean(nextChatsCursor);
 
   return (
     <ChatContext.Provider value={{
@@ -174,7 +250,11 @@ export const ChatProvider = ({ children }) => {
       deleteChat,
       updateChatTitle,
       sendMessage,
-      loadChats
+      loadChats,
+      loadMoreChats,
+      hasMoreChats,
+      loadOlderMessages,
+      hasOlderMessages
     }}>
       {children}
     </ChatContext.Provider>
@@ -0,0 +1,38 @@
+"""Shared fixtures: the app against an in-memory Mongo and the offline LLM provider."""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ["MONGO_URL"] = "mongomock://"
+os.environ["DB_NAME"] = "faisal_tests"
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["FAKE_LLM_LATENCY_MS"] = "1"
+os.environ["FAKE_LLM_TOKENS_PER_SEC"] = "0"
+os.environ["METRICS_ENABLED"] = "0"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from database import INDEXES  # noqa: E402
+
+COLLECTIONS = list(INDEXES) + ["answer_cache"]
+
+
+@pytest.fixture
+def client():
+    with TestClient(server.app) as test_client:
+        yield test_client
+        for collection in COLLECTIONS:
+            test_client.portal.call(server.db[collection].delete_many, {})
+        server.chat_cache.clear()
+
+
+@pytest.fixture
+def db(client):
+    """Run a database coroutine from the test, e.g. ``db(lambda d: d.chats.count_documents({}))``"""
+    return lambda call: client.portal.call(lambda: call(server.db))
+
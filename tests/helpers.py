@@ -0,0 +1,9 @@
+"""Helpers shared by the API tests."""
+
+
+def new_chat(client) -> str:
+    return client.post("/api/chats", json={}).json()["chat"]["id"]
+
+
+def send(client, chat_id: str, content: str, **params):
+    return client.post(f"/api/chats/{chat_id}/messages", params=params, json={"content": content, "chat_id": chat_id})
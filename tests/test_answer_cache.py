@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import server
+from answer_cache import MemoryAnswerCache, MongoAnswerCache, cache_key
+from tests.helpers import new_chat, send
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_ignore_spelling_and_sentence_punctuation():
+    assert cache_key("general", "ما هو قانون نيوتن الثاني؟") == cache_key("general", "  ما هو قانون نيوتن الثانى ")
+    assert cache_key("general", "احسب 3.5") != cache_key("general", "احسب 35")
+    assert cache_key("general", "سؤال") != cache_key("educational", "سؤال")
+
+
+def test_memory_cache_hits_misses_and_expiry():
+    clock = Clock()
+    cache = MemoryAnswerCache(ttl=10, max_entries=10, clock=clock)
+
+    async def main():
+        assert await cache.get("general", "q") is None
+        await cache.set("general", "q", "a")
+        assert await cache.get("general", "Q") == "a"
+        clock.now = 10
+        assert await cache.get("general", "q") is None
+
+    asyncio.run(main())
+    assert (cache.hits, cache.misses, cache.stores) == (1, 2, 1)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryAnswerCache(ttl=10, max_entries=2)
+
+    async def main():
+        await cache.set("general", "a", "1")
+        await cache.set("general", "b", "2")
+        await cache.get("general", "a")
+        await cache.set("general", "c", "3")
+        return [await cache.get("general", prompt) for prompt in ("a", "b", "c")]
+
+    assert asyncio.run(main()) == ["1", None, "3"]
+    assert cache.stats()["size"] == 2
+
+
+def test_mongo_cache_is_trimmed_to_its_size(client):
+    cache = MongoAnswerCache(server.db, ttl=60, max_entries=2)
+
+    async def main():
+        for prompt in ("a", "b", "c"):
+            await cache.set("general", prompt, prompt)
+        await cache.trim()
+        return [await cache.get("general", prompt) for prompt in ("a", "b", "c")]
+
+    assert client.portal.call(main) == [None, "b", "c"]
+
+
+@pytest.fixture
+def answer_cache(monkeypatch):
+    cache = MemoryAnswerCache(ttl=60, max_entries=10)
+    monkeypatch.setattr(server, "answer_cache", cache)
+    return cache
+
+
+def test_only_first_turns_use_the_cache(client, answer_cache):
+    first = send(client, new_chat(client), "ما هو الضوء؟").json()["messages"][1]["content"]
+
+    chat_id = new_chat(client)
+    assert send(client, chat_id, "ما هو الضوء").json()["messages"][1]["content"] == first
+    assert answer_cache.hits == 1
+
+    # A later turn has history: it is neither looked up nor stored
+    send(client, chat_id, "ما هو الضوء")
+    assert (answer_cache.hits, answer_cache.misses, answer_cache.stores) == (1, 1, 1)
+
+
+def test_the_cache_is_off_with_session_history(client, answer_cache, monkeypatch):
+    monkeypatch.setattr(server, "CONTEXT_TOKEN_BUDGET", 0)
+    send(client, new_chat(client), "ما هو الضوء؟")
+    assert answer_cache.stats()["hits"] + answer_cache.stats()["misses"] == 0
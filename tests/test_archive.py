@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+import message_store
+import server
+from chat_archive import ChatArchiver
+from retention import RetentionEngine
+from tests.helpers import new_chat, send
+
+
+def compact(client, chat_id):
+    archiver = ChatArchiver(server.db, idle_days=1)
+    assert client.portal.call(archiver.compact_chat, {"id": chat_id})
+    server.invalidate_chats([chat_id])
+
+
+def seqs(client, chat_id, **params):
+    return [message["seq"] for message in client.get(f"/api/chats/{chat_id}", params=params).json()["messages"]]
+
+
+def test_archived_history_pages_together_with_new_messages(client, db):
+    chat_id = new_chat(client)
+    send(client, chat_id, "one")
+    send(client, chat_id, "two")
+    compact(client, chat_id)
+    assert db(lambda d: d.messages.count_documents({"chat_id": chat_id})) == 0
+
+    send(client, chat_id, "three")
+    assert seqs(client, chat_id) == [0, 1, 2, 3, 4, 5]
+    assert seqs(client, chat_id, limit=3) == [3, 4, 5]
+    assert seqs(client, chat_id, limit=2, before=5) == [3, 4]
+    assert seqs(client, chat_id, limit=3, before=4) == [1, 2, 3]
+    assert seqs(client, chat_id, limit=3, before=2) == [0, 1]
+    assert seqs(client, chat_id, before=0) == []
+
+    listed = next(chat for chat in client.get("/api/chats").json() if chat["id"] == chat_id)
+    assert [message["content"] for message in listed["messages"]][::2] == ["one", "two", "three"]
+
+
+def test_chats_without_archived_messages_to_load_skip_the_archive(client, monkeypatch):
+    chat_id = new_chat(client)
+    for content in ("one", "two", "three"):
+        send(client, chat_id, content)
+    retention = RetentionEngine(server.db, timedelta(days=1), pause=0, max_messages=2, invalidate=server.invalidate_chats)
+    client.portal.call(retention.trim_chats)
+
+    async def no_archive(db, chat_id):
+        raise AssertionError("the archive was read")
+
+    monkeypatch.setattr(message_store, "load_archived", no_archive)
+    assert seqs(client, chat_id) == [4, 5]
+    assert seqs(client, chat_id, limit=1, before=5) == [4]
+    assert seqs(client, chat_id, before=4) == []
@@ -0,0 +1,18 @@
+import pytest
+
+import server
+from chat_cache import ChatCache
+from tests.helpers import new_chat
+
+
+@pytest.mark.parametrize("validity,served_version", [(60, 0), (0, 1)])
+def test_version_checks_within_the_validity_window(client, db, validity, served_version):
+    chat_id = new_chat(client)
+    cache = ChatCache(server.db, invalidation="version", validity=validity)
+    cache.put(db(lambda d: d.chats.find_one({"id": chat_id})))
+    # Written by another worker
+    db(lambda d: d.chats.update_one({"id": chat_id}, {"$inc": {"version": 1}}))
+
+    chat = client.portal.call(cache.get, chat_id)
+    assert chat["version"] == served_version
+    assert cache.stale == (1 if served_version else 0)
@@ -0,0 +1,17 @@
+from tests.helpers import new_chat
+
+
+def test_full_chat_list_links_the_next_page(client):
+    created = {new_chat(client) for _ in range(3)}
+
+    seen, url, pages = [], "/api/chats?limit=2", 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen += [chat["id"] for chat in response.json()]
+        url = response.links.get("next", {}).get("url")
+        pages += 1
+
+    assert pages == 2
+    assert len(seen) == 3
+    assert set(seen) == created
@@ -0,0 +1,46 @@
+import server
+from context_builder import ContextBuilder
+from tests.helpers import new_chat, send
+
+
+def test_summary_is_refreshed_outside_the_turn(client, db):
+    summarized = []
+
+    async def summarize(previous, messages):
+        summarized.append([m["content"] for m in messages])
+        return "summary"
+
+    builder = ContextBuilder(server.db, token_budget=80, summarize=summarize, summary_tokens=10)
+    chat_id = new_chat(client)
+    for content in ("first " * 8, "second " * 8, "third " * 8):
+        assert send(client, chat_id, content).status_code == 200
+
+    chat = db(lambda d: d.chats.find_one({"id": chat_id}))
+    context = client.portal.call(builder.build, chat)
+    # Building never summarizes: the turns that no longer fit are left out
+    assert summarized == []
+    assert context.summary is None
+    assert len(context.messages) < 6
+
+    assert client.portal.call(builder.refresh, chat_id)
+    assert summarized[0][0] == "first " * 8
+    chat = db(lambda d: d.chats.find_one({"id": chat_id}))
+    assert chat["summary"]["text"] == "summary"
+    context = client.portal.call(builder.build, chat)
+    assert context.summary == "summary"
+    assert context.messages[0]["seq"] == chat["summary"]["upto_seq"]
+    # Nothing else fell out of the window
+    assert not client.portal.call(builder.refresh, chat_id)
+
+
+def test_turns_reuse_the_chat_client_with_bounded_context(client):
+    chat_id = new_chat(client)
+    assert send(client, chat_id, "first question").status_code == 200
+    assert send(client, chat_id, "second question").status_code == 200
+
+    assert server.llm_clients.stats()["hits"] >= 1
+    ai_chat = server.llm_clients.get("general", chat_id)
+    # The context of the second turn is in the system message, not in a session history
+    assert "first question" in ai_chat.system_message
+    assert all(len(history) == 2 for history in ai_chat.histories.values())
+    assert ai_chat.histories[ai_chat.session_id][0] == "second question"
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from chat_export import InvalidRecord, import_doc
+from tests.helpers import new_chat, send
+
+CHAT = {"id": "c1", "title": "t", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"}
+MESSAGE = {"id": "m1", "chat_id": "c1", "seq": 0, "role": "user", "content": "hi", "timestamp": "2024-01-01T00:00:00"}
+
+
+def import_lines(client, kind, records):
+    body = "\n".join(json.dumps(record) for record in records).encode()
+    response = client.post("/api/import", params={"kind": kind}, content=body)
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.parametrize("kind,record", [
+    ("chats", {"id": "bad", "title": "x"}),
+    ("chats", {**CHAT, "created_at": "yesterday"}),
+    ("chats", {**CHAT, "updated_at": 5}),
+    ("chats", {**CHAT, "message_count": -1}),
+    ("messages", {**MESSAGE, "seq": "0"}),
+    ("messages", {**MESSAGE, "seq": True}),
+    ("messages", {**MESSAGE, "seq": -1}),
+    ("messages", {k: v for k, v in MESSAGE.items() if k != "timestamp"}),
+    ("messages", {**MESSAGE, "role": "system"}),
+    ("messages", {**MESSAGE, "content": None}),
+])
+def test_invalid_records_are_rejected(kind, record):
+    with pytest.raises(InvalidRecord):
+        import_doc(kind, record)
+
+
+def test_invalid_lines_are_not_stored(client):
+    result = import_lines(client, "chats", [{"id": "bad", "title": "x"}, CHAT])
+    assert result["inserted"] == 1
+    assert result["errors"] == 1
+    assert result["error_samples"][0]["line"] == 1
+
+    # The chat list still works in both modes
+    assert client.get("/api/chats").status_code == 200
+    assert client.get("/api/chats", params={"summary": True}).status_code == 200
+
+
+def test_reimport_leaves_records_unchanged(client, db):
+    chat_id = new_chat(client)
+    send(client, chat_id, "hello")
+    chats = client.get("/api/export", params={"kind": "chats"}).content
+    messages = client.get("/api/export", params={"kind": "messages"}).content
+    stored_before = db(lambda d: d.messages.find({}, {"_id": 0, "search_text": 0}).to_list(None))
+
+    for kind, body in (("chats", chats), ("messages", messages)):
+        result = client.post("/api/import", params={"kind": kind}, content=body).json()
+        assert result["errors"] == 0
+        assert result["inserted"] == 0
+    assert result["updated"] == 0
+
+    assert db(lambda d: d.messages.find({}, {"_id": 0, "search_text": 0}).to_list(None)) == stored_before
+    assert client.get("/api/export", params={"kind": "chats"}).content == chats
+    assert len(client.get(f"/api/chats/{chat_id}").json()["messages"]) == 2
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import server
+from server import Message
+from tests.helpers import new_chat
+
+
+def store_job(db, chat_id: str, job_id: str, status: str, lease_until: datetime):
+    now = datetime.utcnow()
+    db(lambda d: d.message_jobs.insert_one({
+        "_id": job_id,
+        "id": job_id,
+        "chat_id": chat_id,
+        "content": "hello",
+        "limit": None,
+        "status": status,
+        "created_at": now,
+        "expires_at": now + timedelta(days=1),
+        "started_at": now,
+        "lease_until": lease_until,
+    }))
+
+
+def recover(client):
+    return client.portal.call(server.message_jobs.recover)
+
+
+def count_messages(db, chat_id: str) -> int:
+    return db(lambda d: d.messages.count_documents({"chat_id": chat_id}))
+
+
+def test_expired_running_job_is_answered(client, db):
+    chat_id = new_chat(client)
+    store_job(db, chat_id, "j1", "running", datetime.utcnow() - timedelta(seconds=1))
+
+    assert recover(client) == 1
+    job = client.get("/api/jobs/j1", params={"wait": 5}).json()
+    assert job["status"] == "done"
+    assert [m["role"] for m in job["result"]["messages"]] == ["user", "assistant"]
+    assert count_messages(db, chat_id) == 2
+
+
+def test_leased_running_job_is_left_alone(client, db):
+    chat_id = new_chat(client)
+    store_job(db, chat_id, "j1", "running", datetime.utcnow() + timedelta(seconds=60))
+
+    assert recover(client) == 0
+    assert db(lambda d: d.message_jobs.find_one({"_id": "j1"}))["status"] == "running"
+
+
+def test_recovered_job_does_not_repeat_a_stored_turn(client, db):
+    chat_id = new_chat(client)
+    store_job(db, chat_id, "j1", "running", datetime.utcnow() - timedelta(seconds=1))
+    # The crashed worker stored the turn before it could finish the job
+    client.portal.call(server.save_turn, chat_id, Message(role="user", content="hello"), "stored answer", "j1")
+
+    assert recover(client) == 1
+    job = client.get("/api/jobs/j1", params={"wait": 5}).json()
+    assert job["status"] == "done"
+    assert [m["content"] for m in job["result"]["messages"]] == ["hello", "stored answer"]
+    assert "job_id" not in job["result"]["messages"][0]
+    assert count_messages(db, chat_id) == 2
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from llm_admission import AdmissionController, AdmissionRejected
+from llm_failover import LatencyTracker, LlmRouter, LlmTarget, LlmUnavailable, RoutePolicy
+
+PRIMARY = LlmTarget("primary", "m1")
+FALLBACK = LlmTarget("fallback", "m2")
+
+
+class ScriptedChat:
+    """An AI chat client answering after ``delay``, or failing with ``error``"""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+
+    async def send_message(self, message):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.name
+
+
+def router(hedge=False, attempt_timeout=1.0, **options):
+    policies = {"general": RoutePolicy([PRIMARY, FALLBACK], attempt_timeout=attempt_timeout, hedge=hedge)}
+    return LlmRouter(policies, **options)
+
+
+def factory(chats):
+    return lambda target, primary: chats[target.provider]
+
+
+def test_a_failing_provider_fails_over():
+    llm = router()
+    chats = {"primary": ScriptedChat("primary", error=RuntimeError("down")), "fallback": ScriptedChat("fallback")}
+    assert asyncio.run(llm.send("general", factory(chats), "hi")) == "fallback"
+    assert llm.failovers == 1
+
+
+def test_all_providers_timing_out():
+    llm = router(attempt_timeout=0.01)
+    chats = {"primary": ScriptedChat("primary", delay=1), "fallback": ScriptedChat("fallback", delay=1)}
+    with pytest.raises(LlmUnavailable) as error:
+        asyncio.run(llm.send("general", factory(chats), "hi"))
+    assert error.value.timed_out
+
+
+def test_a_slow_attempt_is_hedged_on_the_next_provider():
+    tracker = LatencyTracker(min_samples=1)
+    tracker.record(PRIMARY, 0.01)
+    llm = router(hedge=True, tracker=tracker)
+    chats = {"primary": ScriptedChat("primary", delay=0.5), "fallback": ScriptedChat("fallback")}
+    assert asyncio.run(llm.send("general", factory(chats), "hi")) == "fallback"
+    assert (llm.hedges, llm.hedges_won) == (1, 1)
+
+
+def test_calls_over_the_limit_wait_and_get_the_freed_slot():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1)
+    order = []
+
+    async def call(name):
+        async with admission.slot("primary"):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.create_task(call("first"))
+        second = asyncio.create_task(call("second"))
+        await asyncio.sleep(0)
+        # The queue holds one waiter already
+        with pytest.raises(AdmissionRejected) as error:
+            await call("third")
+        assert error.value.reason == "queue_full"
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+    assert order == ["first", "second"]
+    stats = admission.stats()["primary"]
+    assert (stats["active"], stats["admitted"], stats["queued"], stats["rejected"]) == (0, 2, 1, 1)
+
+
+def test_waiting_past_the_queue_budget_is_rejected():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.01)
+
+    async def main():
+        async with admission.slot("primary"):
+            with pytest.raises(AdmissionRejected) as error:
+                async with admission.slot("primary"):
+                    pass
+            return error.value
+
+    assert asyncio.run(main()).reason == "queue_timeout"
+
+
+def test_a_saturated_provider_is_failed_over():
+    admission = AdmissionController(max_concurrency=0, max_queue=0, provider_limits={"primary": 1})
+    llm = router(admission=admission)
+    chats = {"primary": ScriptedChat("primary"), "fallback": ScriptedChat("fallback")}
+
+    async def main():
+        async with admission.slot("primary"):
+            return await llm.send("general", factory(chats), "hi")
+
+    assert asyncio.run(main()) == "fallback"
+    assert llm.failovers == 1
+
+
+def test_a_stream_stalling_after_its_first_token_fails():
+    llm = router(attempt_timeout=0.05)
+
+    async def stalled_reply(chat, message):
+        yield chat.name
+        await asyncio.sleep(1)
+        yield "never"
+
+    async def main():
+        tokens = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for token in llm.stream("general", factory({"primary": ScriptedChat("primary")}), "hi", stalled_reply):
+                tokens.append(token)
+        return tokens
+
+    assert asyncio.run(main()) == ["primary"]
+    assert llm.failovers == 0
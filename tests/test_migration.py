@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import server
+from message_store import migrate_embedded_chats
+from tests.helpers import send
+
+
+def prepared(client):
+    """Wait for startup, whose migration of legacy chats would race the test"""
+
+    async def wait():
+        await server.app.state.prepare_task
+
+    client.portal.call(wait)
+
+
+def store_legacy_chat(db, chat_id: str, contents):
+    """A chat in the original schema, embedding its messages"""
+    now = datetime.utcnow()
+    messages = [
+        {"id": f"{chat_id}-{i}", "role": "user" if i % 2 == 0 else "assistant", "content": content, "timestamp": now}
+        for i, content in enumerate(contents)
+    ]
+    db(lambda d: d.chats.insert_one({
+        "id": chat_id, "title": "قديمة", "messages": messages, "created_at": now, "updated_at": now,
+    }))
+
+
+def test_a_legacy_chat_is_migrated_when_it_is_opened_and_sent_to(client, db):
+    prepared(client)
+    store_legacy_chat(db, "legacy", ["one", "two"])
+
+    chat = client.get("/api/chats/legacy").json()
+    assert [(m["seq"], m["content"]) for m in chat["messages"]] == [(0, "one"), (1, "two")]
+    assert "messages" not in db(lambda d: d.chats.find_one({"id": "legacy"}))
+
+    chat = send(client, "legacy", "three").json()
+    assert [m["seq"] for m in chat["messages"]] == [0, 1, 2, 3]
+    assert chat["messages"][2]["content"] == "three"
+    assert db(lambda d: d.messages.count_documents({"chat_id": "legacy"})) == 4
+
+
+def test_legacy_chats_are_summarized_from_their_messages(client, db):
+    prepared(client)
+    store_legacy_chat(db, "legacy", ["one", "two"])
+
+    [summary] = client.get("/api/chats", params={"summary": True}).json()["chats"]
+    assert (summary["message_count"], summary["last_message"]) == (2, "two")
+
+
+def test_embedded_chats_are_migrated_in_bulk(client, db):
+    prepared(client)
+    store_legacy_chat(db, "a", ["one"])
+    store_legacy_chat(db, "b", [])
+
+    assert client.portal.call(migrate_embedded_chats, server.db) == 2
+    assert client.portal.call(migrate_embedded_chats, server.db) == 0
+    chats = {chat["id"]: chat for chat in db(lambda d: d.chats.find().to_list(None))}
+    assert (chats["a"]["message_count"], chats["a"]["last_message"]) == (1, "one")
+    assert chats["b"]["message_count"] == 0
+    assert [m["seq"] for m in db(lambda d: d.messages.find({"chat_id": "a"}).to_list(None))] == [0]
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+import server
+from retention import RetentionEngine
+from tests.helpers import new_chat, send
+
+
+def engine(db, **options):
+    return RetentionEngine(db, timedelta(days=1), pause=0, **options)
+
+
+def test_trim_cutoffs_are_bounded_by_the_batch_size():
+    retention = engine(None, max_messages=10, batch_size=100)
+    chats = [
+        {"id": "a", "message_count": 50},
+        {"id": "b", "message_count": 300, "trimmed_upto": 20},
+        {"id": "c", "message_count": 400},
+    ]
+    assert retention._trim_cutoffs(chats) == {"a": 40, "b": 80}
+
+
+def test_trimmed_chats_report_where_their_history_starts(client):
+    chat_id = new_chat(client)
+    for content in ("one", "two", "three"):
+        assert send(client, chat_id, content).status_code == 200
+
+    retention = engine(server.db, max_messages=2, batch_size=3, invalidate=server.invalidate_chats)
+    assert client.portal.call(retention.trim_chats) == 4
+
+    chat = client.get(f"/api/chats/{chat_id}").json()
+    assert chat["trimmed_upto"] == 4
+    assert [message["seq"] for message in chat["messages"]] == [4, 5]
+
+
+class RecordingDb:
+    """The app database, recording how many messages each delete removes"""
+
+    def __init__(self, db):
+        self.db = db
+        self.message_deletes = []
+
+    def __getattr__(self, name):
+        collection = getattr(self.db, name)
+        if name != "messages":
+            return collection
+        recording = self
+
+        class Messages:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def delete_many(self, *args, **kwargs):
+                result = await collection.delete_many(*args, **kwargs)
+                recording.message_deletes.append(result.deleted_count)
+                return result
+
+            async def bulk_write(self, *args, **kwargs):
+                result = await collection.bulk_write(*args, **kwargs)
+                recording.message_deletes.append(result.deleted_count)
+                return result
+
+        return Messages()
+
+
+def test_long_chats_are_deleted_in_bounded_batches(client, db):
+    long_chat, short_chat = new_chat(client), new_chat(client)
+    for content in ("one", "two", "three"):
+        send(client, long_chat, content)
+    send(client, short_chat, "one")
+
+    recording = RecordingDb(server.db)
+    retention = engine(recording, batch_size=2)
+    deleted = client.portal.call(retention.delete_chats, {"id": {"$in": [long_chat, short_chat]}})
+
+    assert deleted == {"chats": 2, "messages": 8}
+    assert max(recording.message_deletes) <= 2
+    assert db(lambda d: d.messages.count_documents({})) == 0
+    assert db(lambda d: d.chats.count_documents({})) == 0
+    assert sorted(db(lambda d: d.chat_tombstones.distinct("chat_id"))) == sorted([long_chat, short_chat])
@@ -0,0 +1,58 @@
+from arabic_text import search_stem, search_text, search_tokens
+from search import best_archived_match, highlight, rank_matches
+
+
+def test_tokens_are_normalized_and_stripped_of_the_article():
+    assert search_tokens("الرِّياضيات والفيزياء") == ["رياضيات", "فيزياء"]
+    assert search_tokens("مدرسـة أحمد") == ["مدرسه", "احمد"]
+    assert search_text("Hello, العالم!") == "hello عالم"
+
+
+def test_short_words_keep_their_article_letters():
+    assert search_stem("الم") == "الم"
+    assert search_stem("للطلاب") == "طلاب"
+
+
+def test_highlight_maps_normalized_matches_back_to_the_text():
+    text = "درس في الرِّياضيات اليوم"
+    snippet, highlights = highlight(text, ["رياضيات"])
+    assert snippet == text
+    assert [snippet[start:end] for start, end in highlights] == ["الرِّياضيات"]
+
+
+def test_highlight_cuts_a_snippet_around_the_first_match():
+    text = "كلام " * 50 + "فيزياء" + " كلام" * 50
+    snippet, highlights = highlight(text, ["فيزياء"], length=40)
+    assert snippet.startswith("...") and snippet.endswith("...")
+    assert [snippet[start:end] for start, end in highlights] == ["فيزياء"]
+
+
+def test_highlight_without_a_match_starts_at_the_beginning():
+    snippet, highlights = highlight("نص طويل " * 30, ["غير"], length=20)
+    assert not snippet.startswith("...")
+    assert highlights == []
+
+
+def test_matches_are_combined_and_ranked_per_chat():
+    ranked, order = rank_matches(
+        [{"id": "title", "score": 1.0}, {"id": "both", "score": 0.5}],
+        [
+            {"_id": "both", "score": 1.5, "matches": 2, "message_id": "m1"},
+            {"_id": "tie", "score": 2.0, "matches": 3, "message_id": "m2"},
+            {"_id": "message", "score": 2.0, "matches": 1, "message_id": "m3"},
+        ],
+        [{"_id": "archived", "score": 0.5}],
+    )
+    assert order == ["both", "tie", "message", "title", "archived"]
+    assert ranked["both"] == {"score": 2.5, "matches": 2, "message_id": "m1"}
+    assert ranked["archived"]["archived"] is True
+
+
+def test_best_archived_match_counts_distinct_query_words():
+    messages = [
+        {"id": "a", "content": "رياضيات رياضيات"},
+        {"id": "b", "content": "الرياضيات والفيزياء"},
+        {"id": "c", "content": "لا شيء"},
+    ]
+    assert best_archived_match(messages, ["رياضيات", "فيزياء"])["id"] == "b"
+    assert best_archived_match(messages, ["كيمياء"]) is None
@@ -0,0 +1,25 @@
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_a_failing_startup_step_does_not_stop_the_others(monkeypatch):
+    recovered = []
+
+    async def fail(db):
+        raise RuntimeError("migration failed")
+
+    async def recover(startup=False):
+        recovered.append(startup)
+        return 0
+
+    monkeypatch.setattr(server, "migrate_embedded_chats", fail)
+    monkeypatch.setattr(server.message_jobs, "recover", recover)
+
+    async def prepared():
+        await server.app.state.prepare_task
+
+    with TestClient(server.app) as client:
+        client.portal.call(prepared)
+        assert recovered == [True]
+        assert client.get("/api/health/ready").status_code == 200
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import time
+
+import server
+from server import MessageCreate
+from tests.helpers import new_chat
+
+
+def read_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_a_streamed_reply_ends_with_the_stored_chat(client):
+    chat_id = new_chat(client)
+    response = client.post(f"/api/chats/{chat_id}/messages/stream", json={"content": "ما هو الضوء", "chat_id": chat_id})
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = read_events(response.text)
+    assert [event for event, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    event, chat = events[-1]
+    assert event == "done"
+    reply = "".join(data["content"] for _, data in events[:-1])
+    assert [(m["role"], m["content"]) for m in chat["messages"]] == [("user", "ما هو الضوء"), ("assistant", reply)]
+
+
+def test_the_turn_is_stored_after_the_client_disconnects(client, db, monkeypatch):
+    async def slow_reply(chat, user_message):
+        yield "first"
+        await asyncio.sleep(0.1)
+        yield " second"
+
+    monkeypatch.setattr(server, "stream_reply", slow_reply)
+    chat_id = new_chat(client)
+    message = MessageCreate(content="ما هي الجاذبية", chat_id=chat_id)
+
+    async def disconnect_after_the_first_token():
+        response = await server.stream_message(chat_id, message, None)
+        events = response.body_iterator
+        first = await events.__anext__()
+        await events.aclose()
+        return first
+
+    assert '"first"' in client.portal.call(disconnect_after_the_first_token)
+    deadline = time.monotonic() + 5
+    while db(lambda d: d.messages.count_documents({"chat_id": chat_id})) < 2 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    messages = db(lambda d: d.messages.find({"chat_id": chat_id}).sort("seq", 1).to_list(None))
+    assert [m["content"] for m in messages] == ["ما هي الجاذبية", "first second"]
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+from sync import decode_sync_token, encode_sync_token
+from tests.helpers import new_chat, send
+
+
+def sync(client, token=None, limit=100):
+    params = {"limit": limit}
+    if token:
+        params["since"] = token
+    response = client.get("/api/chats/changes", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def sync_all(client, token, limit):
+    """Follow ``next_token`` until caught up, collecting every page"""
+    chats, messages, deleted = [], [], []
+    while True:
+        page = sync(client, token, limit)
+        chats += [chat["id"] for chat in page["chats"]]
+        messages += [message["content"] for message in page["messages"]]
+        deleted += page["deleted"]
+        token = page["next_token"]
+        if not page["has_more"]:
+            return chats, messages, deleted, token
+
+
+def backdate(db, days=1):
+    """Move every write back in time so the next token predates the writes that follow"""
+    past = datetime.utcnow() - timedelta(days=days)
+    db(lambda d: d.chats.update_many({}, {"$set": {"updated_at": past}}))
+    db(lambda d: d.messages.update_many({}, {"$set": {"stored_at": past}}))
+
+
+def test_first_sync_returns_everything(client):
+    chat_id = new_chat(client)
+    send(client, chat_id, "hello")
+    page = sync(client)
+    assert [chat["id"] for chat in page["chats"]] == [chat_id]
+    assert [message["seq"] for message in page["messages"]] == [0, 1]
+    assert page["has_more"] is False
+
+
+def test_paged_sync_keeps_messages_stored_before_page_boundary(client, db):
+    chat_c = new_chat(client)
+    chat_a = new_chat(client)
+    backdate(db)
+    token = sync(client)["next_token"]
+
+    # C gets a message, then A is updated, then C gets a second message:
+    # C sorts after A, on the second page, past A's updated_at
+    send(client, chat_c, "first C")
+    send(client, chat_a, "A")
+    send(client, chat_c, "second C")
+
+    chats, messages, _, _ = sync_all(client, token, limit=1)
+    assert chats == [chat_a, chat_c]
+    assert "first C" in messages
+    assert "second C" in messages
+    assert "A" in messages
+    assert len(messages) == 6
+
+
+def test_caught_up_token_only_returns_new_changes(client, db):
+    chat_id = new_chat(client)
+    send(client, chat_id, "old")
+    backdate(db)
+    token = sync(client)["next_token"]
+    send(client, chat_id, "new")
+    _, messages, _, token = sync_all(client, token, limit=1)
+    assert "old" not in messages
+    assert "new" in messages
+
+
+def test_deleted_chats_are_reported(client, db):
+    chat_id = new_chat(client)
+    backdate(db)
+    token = sync(client)["next_token"]
+    client.delete(f"/api/chats/{chat_id}")
+    _, _, deleted, _ = sync_all(client, token, limit=1)
+    assert deleted == [chat_id]
+
+
+def test_chats_deleted_during_a_paged_first_sync_are_reported(client, db):
+    new_chat(client)
+    new_chat(client)
+    backdate(db)
+    page = sync(client, limit=1)
+    chat_a = page["chats"][0]["id"]
+
+    # The first page ran a while ago; A was deleted since, 10 s before the last page
+    since, sync_started, position, after_id = decode_sync_token(page["next_token"])
+    token = encode_sync_token(since, sync_started - timedelta(seconds=20), position, after_id)
+    client.delete(f"/api/chats/{chat_a}")
+    ten_seconds_ago = datetime.utcnow() - timedelta(seconds=10)
+    db(lambda d: d.chat_tombstones.update_many({}, {"$set": {"deleted_at": ten_seconds_ago}}))
+
+    _, _, deleted, token = sync_all(client, token, limit=1)
+    _, _, deleted_next, _ = sync_all(client, token, limit=1)
+    assert chat_a in deleted + deleted_next
+
+
+def test_invalid_and_expired_tokens(client):
+    assert client.get("/api/chats/changes", params={"since": "not a token"}).status_code == 400
+    old = datetime.utcnow() - timedelta(days=365)
+    expired = encode_sync_token(old, None, old, "")
+    assert client.get("/api/chats/changes", params={"since": expired}).status_code == 410
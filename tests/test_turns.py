@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from chat_turns import ChatTurnQueue, TurnQueueFull
+
+
+def test_turns_of_a_chat_run_one_at_a_time_in_order():
+    queue = ChatTurnQueue()
+    events = []
+
+    async def turn(name, delay):
+        events.append(f"start {name}")
+        await asyncio.sleep(delay)
+        events.append(f"end {name}")
+        return name
+
+    async def main():
+        return await asyncio.gather(
+            queue.run("c1", None, lambda: turn("a", 0.02)),
+            queue.run("c1", None, lambda: turn("b", 0)),
+            queue.run("c2", None, lambda: turn("other", 0)),
+        )
+
+    assert asyncio.run(main()) == ["a", "b", "other"]
+    # The other chat does not wait for c1; c1's second turn waits for its first
+    assert events.index("end other") < events.index("end a")
+    assert events.index("end a") < events.index("start b")
+    assert queue.stats()["active_chats"] == 0
+
+
+def test_a_retried_turn_shares_the_result_of_the_one_in_flight():
+    queue = ChatTurnQueue()
+    calls = []
+
+    async def turn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(
+            queue.run("c1", "m1", turn),
+            queue.run("c1", "m1", turn),
+            queue.run("c1", None, turn),
+        )
+
+    assert asyncio.run(main()) == [1, 1, 2]
+    assert queue.coalesced == 1
+    assert queue.turns == 2
+
+
+def test_pending_turns_per_chat_are_bounded():
+    queue = ChatTurnQueue(max_pending=1)
+
+    async def main():
+        first = asyncio.create_task(queue.run("c1", None, lambda: asyncio.sleep(0.01)))
+        await asyncio.sleep(0)
+        with pytest.raises(TurnQueueFull):
+            await queue.run("c1", None, lambda: asyncio.sleep(0))
+        await first
+
+    asyncio.run(main())
+    assert queue.rejected == 1